@@ -1,14 +1,102 @@
 import webbrowser
 import time
 import dash
+import flask
 from dash import dcc, html, dash_table, Input, Output, State, ctx
 import pandas as pd
+import numpy as np
 import dash_bootstrap_components as dbc
+import os
+import re
+import hashlib
 import io
-import base64
+import csv
+import cProfile
+import contextlib
+import json
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import socket
+import mimetypes
+import sqlite3
+import string
 import smtplib
+import tempfile
+import openpyxl
 import xlsxwriter
-from email.message import EmailMessage
+from collections import Counter, OrderedDict, deque
+from email.message import EmailMessage, MIMEPart
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # Spilling is skipped without pyarrow; uploads are re-parsed instead
+    feather = None
+
+# Dataset cache settings (memory budget in bytes, entry lifetime in seconds)
+DATASET_CACHE_MAX_BYTES = int(os.environ.get("DATASET_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+DATASET_CACHE_TTL = int(os.environ.get("DATASET_CACHE_TTL", 30 * 60))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("INDEX_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+FILTER_CACHE_MAX_BYTES = int(os.environ.get("FILTER_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+# Columnar spill of parsed uploads (Arrow IPC files shared by restarts and worker processes)
+DATASET_SPILL_DIR = os.environ.get("DATASET_SPILL_DIR", os.path.join(tempfile.gettempdir(), "email-automation-datasets"))
+DATASET_SPILL_MAX_BYTES = int(os.environ.get("DATASET_SPILL_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+DATASET_SPILL_MAX_AGE = int(os.environ.get("DATASET_SPILL_MAX_AGE", 7 * 24 * 60 * 60))
+
+# Streaming ingestion: rows buffered per chunk before conversion to typed columns
+INGEST_CHUNK_ROWS = int(os.environ.get("INGEST_CHUNK_ROWS", 50000))
+INGEST_POLL_INTERVAL_MS = int(os.environ.get("INGEST_POLL_INTERVAL_MS", 500))
+
+# Chunked upload endpoint (raw uploads are kept here under their dataset ID)
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "email-automation-uploads"))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 1024 * 1024 * 1024))
+UPLOAD_MAX_CHUNK_BYTES = int(os.environ.get("UPLOAD_MAX_CHUNK_BYTES", 16 * 1024 * 1024))
+UPLOAD_MAX_AGE = int(os.environ.get("UPLOAD_MAX_AGE", 7 * 24 * 60 * 60))
+
+# Attachments: per-row files are encoded on first use and kept in a bounded cache
+ATTACHMENT_CACHE_MAX_BYTES = int(os.environ.get("ATTACHMENT_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+# Exports are written to files here and streamed by the /export route (identical exports are reused)
+EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "email-automation-exports"))
+EXPORT_MAX_BYTES = int(os.environ.get("EXPORT_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+EXPORT_MAX_AGE = int(os.environ.get("EXPORT_MAX_AGE", 60 * 60))
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 10000))
+
+# SMTP settings (defaults can be overridden per send from the UI)
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+SMTP_USE_TLS = os.environ.get("SMTP_USE_TLS", "1") != "0"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 30))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get("SMTP_MAX_MESSAGES_PER_CONNECTION", 90))
+SMTP_KEEPALIVE_INTERVAL = float(os.environ.get("SMTP_KEEPALIVE_INTERVAL", 30))
+SMTP_MAX_RETRIES = int(os.environ.get("SMTP_MAX_RETRIES", 3))
+SMTP_RETRY_CODES = {421, 451}  # Server is closing the connection or asks us to try again
+
+# Sending concurrency and per-account rate limits (defaults for the sender form)
+SMTP_CONCURRENCY = int(os.environ.get("SMTP_CONCURRENCY", 4))
+SENDER_RATE_PER_SECOND = float(os.environ.get("SENDER_RATE_PER_SECOND", 5))
+SENDER_DAILY_LIMIT = int(os.environ.get("SENDER_DAILY_LIMIT", 2000))
+SENDER_MAX_BACKOFF = float(os.environ.get("SENDER_MAX_BACKOFF", 120))
+
+# Background send job settings
+SEND_JOB_WORKERS = int(os.environ.get("SEND_JOB_WORKERS", 2))
+SEND_JOB_RETENTION = int(os.environ.get("SEND_JOB_RETENTION", 60 * 60))
+SEND_JOB_POLL_INTERVAL_MS = int(os.environ.get("SEND_JOB_POLL_INTERVAL_MS", 1000))
+
+# Send journal (SQLite): per-recipient status of each mailing, committed in small batches
+SEND_JOURNAL_PATH = os.environ.get("SEND_JOURNAL_PATH", os.path.join(tempfile.gettempdir(), "email-automation-journal.sqlite3"))
+SEND_JOURNAL_BATCH_SIZE = int(os.environ.get("SEND_JOURNAL_BATCH_SIZE", 50))
+SEND_JOURNAL_FLUSH_INTERVAL = float(os.environ.get("SEND_JOURNAL_FLUSH_INTERVAL", 1.0))
+
+# Instrumentation: Prometheus-style /metrics route, and cProfile for single requests
+# (sent with an "X-Profile: 1" header or "?profile=1") when PROFILE_ENABLED is set
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "email-automation-profiles"))
 
 # Initialize Dash App
 # app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -39,14 +127,17 @@ app.layout = dbc.Container([
     dbc.Row(
         dbc.Col(
             html.Div([
-                dcc.Upload(
-                    id="upload-excel",
-                    children=html.Button("Upload Excel File", className="btn btn-primary"),
-                    multiple=False
-                ),
+                # The file goes to the /upload routes in resumable chunks (assets/chunked_upload.js);
+                # callbacks only ever see the small dataset ID it returns
+                html.Button("Upload Excel / CSV File", id="upload-file-btn", className="btn btn-primary"),
+                html.Div(id="upload-status", style={"textAlign": "center", "marginTop": "5px", "color": "#555"}),
                 html.Div(id="uploaded-file-name", style={
                     "textAlign": "center", "marginTop": "10px", "fontWeight": "bold"
-                })
+                }),
+                html.Div(id="ingest-progress", style={"textAlign": "center", "marginTop": "5px", "color": "#555"}),
+                dcc.Store(id="dataset-id"),
+                dcc.Store(id="dataset-filename"),
+                dcc.Interval(id="ingest-poll", interval=INGEST_POLL_INTERVAL_MS, disabled=True)
             ], style={
                 "textAlign": "center", "padding": "20px"
             }),
@@ -95,7 +186,15 @@ app.layout = dbc.Container([
                 id="filtered-table",
                 columns=[],
                 data=[],
+                page_current=0,
                 page_size=10,
+                page_count=0,
+                page_action="custom",
+                sort_action="custom",
+                sort_mode="multi",
+                sort_by=[],
+                filter_action="custom",
+                filter_query="",
                 style_table={"overflowX": "auto", "width": "80%", "margin": "auto", "border": "1px solid #ddd", "borderRadius": "8px", "boxShadow": "2px 2px 10px rgba(0, 0, 0, 0.1)", "padding": "10px", "backgroundColor": "#ffffff"},
                 style_header={"backgroundColor": "#007BFF", "color": "white", "fontWeight": "bold", "textAlign": "center"},
                 style_cell={"textAlign": "center", "padding": "8px", "border": "1px solid #ddd"},
@@ -104,11 +203,22 @@ app.layout = dbc.Container([
             width=12
         )
     ),
+    html.Div(id="filter-error", style={"textAlign": "center", "marginTop": "10px", "color": "#dc3545"}),
+    html.Div(id="filtered-row-count", style={"textAlign": "center", "marginTop": "10px", "fontWeight": "bold"}),
+    dcc.Store(id="filtered-result"),
     # Download Filtered Data
     dbc.Row(
         dbc.Col(
             html.Div(
-                html.Button("Download Filtered Data", id="download-btn", className="btn btn-warning mt-2"),
+                html.Div([
+                    dcc.Dropdown(
+                        id="download-format",
+                        options=[{"label": "Excel (.xlsx)", "value": "xlsx"}, {"label": "CSV (.csv)", "value": "csv"},
+                                 {"label": "Parquet (.parquet)", "value": "parquet", "disabled": feather is None}],
+                        value="xlsx", clearable=False, searchable=False
+                    ),
+                    html.Button("Download Filtered Data", id="download-btn", className="btn btn-warning mt-2")
+                ]),
                 style={
                     "textAlign": "center", "marginTop": "10px", "padding": "10px",
                     "backgroundColor": "#f8f9fa", "border": "1px solid #ddd", "borderRadius": "8px",
@@ -118,7 +228,8 @@ app.layout = dbc.Container([
             width=12
         )
     ),
-    dcc.Download(id="download-dataframe-xlsx"),
+    dcc.Store(id="export-url"),
+    html.Div(id="export-download", hidden=True),
 
 
     html.Hr(),
@@ -197,6 +308,50 @@ app.layout = dbc.Container([
                                 dbc.Input(id="company-name", type="text", placeholder="Enter Company Name", className="form-control")
                             ]), width=6
                         )
+                    ], className="mb-3", style={"padding": "10px"}),
+                    dbc.Row([
+                        dbc.Col(
+                            html.Div([
+                                html.Label("SMTP Server", style={"fontWeight": "bold"}),
+                                dbc.Input(id="smtp-host", type="text", value=SMTP_HOST, placeholder="smtp.gmail.com", className="form-control")
+                            ]), width=6
+                        ),
+                        dbc.Col(
+                            html.Div([
+                                html.Label("SMTP Port", style={"fontWeight": "bold"}),
+                                dbc.Input(id="smtp-port", type="number", value=SMTP_PORT, placeholder="587", className="form-control")
+                            ]), width=6
+                        )
+                    ], className="mb-3", style={"padding": "10px"}),
+                    dbc.Row([
+                        dbc.Col(
+                            html.Div([
+                                html.Label("Connections per Account", style={"fontWeight": "bold"}),
+                                dbc.Input(id="smtp-concurrency", type="number", min=1, max=32, value=SMTP_CONCURRENCY, className="form-control")
+                            ]), width=4
+                        ),
+                        dbc.Col(
+                            html.Div([
+                                html.Label("Emails per Second", style={"fontWeight": "bold"}),
+                                dbc.Input(id="sender-rate", type="number", min=0.01, step=0.01, value=SENDER_RATE_PER_SECOND, className="form-control")
+                            ]), width=4
+                        ),
+                        dbc.Col(
+                            html.Div([
+                                html.Label("Daily Limit", style={"fontWeight": "bold"}),
+                                dbc.Input(id="sender-daily-limit", type="number", min=1, value=SENDER_DAILY_LIMIT, className="form-control")
+                            ]), width=4
+                        )
+                    ], className="mb-3", style={"padding": "10px"}),
+                    dbc.Row([
+                        dbc.Col(
+                            html.Div([
+                                html.Label("Additional Sender Accounts", style={"fontWeight": "bold"}),
+                                dbc.Textarea(id="sender-pool", rows=3, className="form-control",
+                                             placeholder="One per line: email, app password[, weight[, smtp host[:port][, "
+                                                         "emails per second[, daily limit]]]]")
+                            ]), width=12
+                        )
                     ], className="mb-3", style={"padding": "10px"})
                 ],
                 style={
@@ -232,7 +387,7 @@ app.layout = dbc.Container([
                                 html.Label("Email Template", style={"fontWeight": "bold"}),
                                 dbc.Textarea(
                                     id="email-template",
-                                    placeholder="Enter email template with {employee_name}, {company_name}, {designation}, {sender_name}",
+                                    placeholder="Enter email template with {employee_name}, {company_name}, {sender_name} or any column, e.g. {Designation}",
                                     className="form-control",
                                     rows=6,
                                     value="""
@@ -247,7 +402,26 @@ Best regards,
 {sender_name}  
 {company_name}
 """
-                                )
+                                ),
+                                html.Div(id="template-error", style={"color": "#dc3545", "marginTop": "5px"})
+                            ]), width=12
+                        )
+                    ], className="mb-3", style={"padding": "10px"}),
+
+                    dbc.Row([
+                        dbc.Col(
+                            html.Div([
+                                html.Label("Attachments", style={"fontWeight": "bold"}),
+                                html.Div([
+                                    html.Button("Add Shared Attachments", id="upload-shared-attachment-btn", className="btn btn-outline-primary btn-sm me-2"),
+                                    html.Button("Add Per-row Attachment Files", id="upload-row-attachment-btn", className="btn btn-outline-primary btn-sm me-2"),
+                                    html.Button("Clear Attachments", id="clear-attachments", className="btn btn-outline-danger btn-sm")
+                                ]),
+                                dcc.Dropdown(id="attachment-column", placeholder="Per-row attachment column (file names)",
+                                             style={"marginTop": "10px"}),
+                                html.Div(id="attachment-list", style={"marginTop": "10px"}),
+                                dcc.Store(id="attachment-upload"),
+                                dcc.Store(id="attachments", data=[])
                             ]), width=12
                         )
                     ], className="mb-3", style={"padding": "10px"}),
@@ -255,13 +429,59 @@ Best regards,
                     dbc.Row(
                         dbc.Col(
                             html.Div([
+                                dbc.Checklist(
+                                    id="resume-send",
+                                    options=[{"label": " Resume: skip recipients who already received this mailing", "value": "resume"}],
+                                    value=[],
+                                    className="mb-2"
+                                ),
+                                html.Button("Check Recipients", id="check-recipients", className="btn btn-outline-secondary mb-2", style={"width": "100%"}),
+                                html.Button("Preview Emails", id="preview-email", className="btn btn-outline-secondary mb-2", style={"width": "100%"}),
                                 html.Button("Send Emails", id="send-email", className="btn btn-success", style={"width": "100%", "fontSize": "18px", "padding": "10px"})
                             ], style={"textAlign": "center", "marginTop": "10px"}),
                             width=12
                         )
                     ),
+                    html.Div(id="recipient-check", className="mt-3"),
+                    html.Div(id="template-preview", className="mt-3", style={"textAlign": "left"}),
                     
-                    html.Div(id="email-status", className="mt-3", style={"textAlign": "center", "fontSize": "16px", "fontWeight": "bold", "color": "#28a745"})
+                    dbc.Row(
+                        dbc.Col(
+                            html.Div([
+                                html.Button("Pause", id="pause-send-job", className="btn btn-outline-secondary btn-sm me-2"),
+                                html.Button("Resume", id="resume-send-job", className="btn btn-outline-primary btn-sm me-2"),
+                                html.Button("Cancel", id="cancel-send-job", className="btn btn-outline-danger btn-sm")
+                            ], style={"textAlign": "center", "marginTop": "10px"}),
+                            width=12
+                        )
+                    ),
+                    dcc.Store(id="send-job-id"),
+                    dcc.Interval(id="send-job-poll", interval=SEND_JOB_POLL_INTERVAL_MS, disabled=True),
+
+                    html.Div(id="email-status", className="mt-3", style={"textAlign": "center", "fontSize": "16px", "fontWeight": "bold", "color": "#28a745"}),
+                    html.Div(id="send-notes", style={"textAlign": "center", "color": "#856404"}),
+                    dcc.Store(id="send-status-seen"),
+                    html.Div([
+                        dcc.RadioItems(id="send-log-filter", value="all", inline=True,
+                                       options=[{"label": " All recipients ", "value": "all"},
+                                                {"label": " Failed only", "value": "failed"}]),
+                        dash_table.DataTable(
+                            id="send-log-table",
+                            columns=[{"name": name, "id": column} for name, column in
+                                     [("Recipient", "recipient"), ("Status", "status"), ("Error", "error"),
+                                      ("Detail", "detail"), ("Latency (ms)", "latency_ms")]],
+                            data=[],
+                            page_current=0,
+                            page_size=10,
+                            page_count=0,
+                            page_action="custom",
+                            style_table={"overflowX": "auto", "margin": "auto"},
+                            style_header={"backgroundColor": "#007BFF", "color": "white", "fontWeight": "bold"},
+                            style_cell={"textAlign": "center", "padding": "6px", "maxWidth": "300px",
+                                        "overflow": "hidden", "textOverflow": "ellipsis"}
+                        ),
+                        html.A("Download Send Log (CSV)", id="send-log-link", className="btn btn-outline-secondary btn-sm mt-2")
+                    ], className="mt-3")
                 ],
                 style={
                     "textAlign": "center", "padding": "15px", "backgroundColor": "#ffffff", "border": "1px solid #ddd",
@@ -274,22 +494,900 @@ Best regards,
 ], fluid=True)
 
 
-# Function to Read Excel File
-def parse_contents(contents):
-    content_type, content_string = contents.split(",")
-    decoded = base64.b64decode(content_string)
-    return pd.read_excel(io.BytesIO(decoded))
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+# Cumulative histogram with one series per label value (rendered in the Prometheus text format)
+class Histogram:
+    def __init__(self, name, help_text, label, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            label = f'{self.label}="{metric_label(label_value)}"'
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{label}}} {values[-2]}")
+            lines.append(f"{self.name}_count{{{label}}} {values[-1]}")
+        return lines
+
+
+# Monotonic counter with one series per label value
+class MetricCounter:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[label_value] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        lines.extend(f'{self.name}{{{self.label}="{metric_label(key)}"}} {value}' for key, value in sorted(values.items()))
+        return lines
+
+
+# Function to Escape a Label Value for the Prometheus Text Format
+def metric_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+callback_duration = Histogram("email_automation_callback_duration_seconds", "Duration of Dash callback requests", "callback")
+callback_request_bytes = Histogram("email_automation_callback_request_bytes", "Size of Dash callback request bodies",
+                                   "callback", SIZE_BUCKETS)
+callback_response_bytes = Histogram("email_automation_callback_response_bytes", "Size of Dash callback responses",
+                                    "callback", SIZE_BUCKETS)
+stage_duration = Histogram("email_automation_stage_duration_seconds",
+                           "Duration of processing stages (parse, filter, render, connect, login, send, ...)", "stage")
+stage_items = MetricCounter("email_automation_items_total",
+                            "Items processed per stage (rows parsed, rows filtered, emails sent, bytes exported, ...)",
+                            "stage")
+METRICS = [callback_duration, callback_request_bytes, callback_response_bytes, stage_duration, stage_items]
+
+
+# Function to Time a Stage: with timed("parse"): ...
+@contextlib.contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(stage, time.perf_counter() - started)
+
+
+# Dash callbacks all arrive on one route; the output they update names the callback
+@app.server.before_request
+def start_request_metrics():
+    flask.g.request_started = time.perf_counter()
+    if PROFILE_ENABLED and (flask.request.headers.get("X-Profile") == "1" or flask.request.args.get("profile") == "1"):
+        flask.g.profiler = cProfile.Profile()
+        flask.g.profiler.enable()
+
+
+@app.server.after_request
+def finish_request_metrics(response):
+    profiler = flask.g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof")
+        profiler.dump_stats(path)
+        response.headers["X-Profile-File"] = path
+    if "request_started" not in flask.g or not flask.request.path.endswith("/_dash-update-component"):
+        return response
+    body = flask.request.get_json(silent=True) or {}
+    callback = body.get("output", "unknown")
+    callback_duration.observe(callback, time.perf_counter() - flask.g.request_started)
+    callback_request_bytes.observe(callback, flask.request.content_length or 0)
+    if not response.direct_passthrough:
+        callback_response_bytes.observe(callback, response.calculate_content_length() or 0)
+    return response
+
+
+@app.server.route("/metrics")
+def metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return flask.Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+# Ingestion progress per dataset key, polled by the UI while an upload is parsed
+ingest_progress = {}
+ingest_progress_lock = threading.Lock()
+
+
+# Function to Record Ingestion Progress
+def report_progress(key, **fields):
+    if key is None:
+        return
+    with ingest_progress_lock:
+        progress = ingest_progress.setdefault(key, {"rows": 0, "fraction": None, "done": False, "error": None})
+        progress.update(fields, updated_at=time.time())
+        for stale in [k for k, p in ingest_progress.items() if p["done"] and time.time() - p["updated_at"] > 3600]:
+            del ingest_progress[stale]
+
+
+# Function to Name Header Cells the Way pandas Does (blank -> "Unnamed: i", repeats -> "name.1")
+def header_names(cells):
+    names, seen = [], {}
+    for i, cell in enumerate(cells):
+        name = f"Unnamed: {i}" if cell is None else cell
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+# Column buffers: rows are collected per chunk as object arrays; each column is typed once in to_frame,
+# so a column that is numeric in one chunk and mixed in another keeps its original values
+class ColumnBuffers:
+    def __init__(self, names, chunk_rows):
+        self.names = list(names)
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._pending = []
+        self._chunks = [[] for _ in self.names]
+
+    # Returns True when the row completed a chunk
+    def append(self, row):
+        self._pending.append(row)
+        if len(self._pending) >= self.chunk_rows:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        if not self._pending:
+            return
+        width = max(len(row) for row in self._pending)
+        for i in range(len(self.names), width):
+            # A data row is wider than the header: add an unnamed column, empty for earlier rows
+            self.names.append(f"Unnamed: {i}")
+            self._chunks.append([pd.Series([None] * self.rows, dtype=object)] if self.rows else [])
+        for i, chunks in enumerate(self._chunks):
+            chunks.append(pd.Series([row[i] if i < len(row) else None for row in self._pending], dtype=object))
+        self.rows += len(self._pending)
+        self._pending = []
+
+    def to_frame(self):
+        self.flush()
+        columns = {}
+        for name, chunks in zip(self.names, self._chunks):
+            column = pd.concat(chunks, ignore_index=True) if chunks else pd.Series([], dtype=object)
+            if column.dtype == object:
+                # Missing cells as NaN and a single dtype across chunks, like pd.read_excel
+                column = column.where(column.notna(), np.nan).infer_objects()
+            columns[name] = column
+            chunks.clear()
+        return pd.DataFrame(columns)
+
+
+# Function to Stream an xlsx Workbook Row by Row (openpyxl read-only mode)
+def read_xlsx_streaming(path, key=None, chunk_rows=INGEST_CHUNK_ROWS):
+    # Opened from a handle: openpyxl rejects file names without an Excel extension
+    with open(path, "rb") as handle:
+        workbook = openpyxl.load_workbook(handle, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            expected_rows = max((sheet.max_row or 0) - 1, 0)
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return pd.DataFrame()
+            while header and header[-1] is None:
+                header = header[:-1]
+            buffers = ColumnBuffers(header_names(header), chunk_rows)
+            blank_rows = 0
+            for row in rows:
+                if all(value is None for value in row):
+                    blank_rows += 1  # Kept only if a non-blank row follows, as pandas drops trailing blanks
+                    continue
+                for _ in range(blank_rows):
+                    buffers.append(())
+                blank_rows = 0
+                while row[-1] is None:
+                    row = row[:-1]
+                if buffers.append(row):
+                    report_progress(key, rows=buffers.rows,
+                                    fraction=min(buffers.rows / expected_rows, 1.0) if expected_rows else None)
+            return buffers.to_frame()
+        finally:
+            workbook.close()
+
+
+# Function to Read a CSV/TSV File in Chunks (delimiter sniffed from the header line).
+# A first pass settles each column's type over the whole file, so the second can convert every
+# chunk to its final dtype as it is read; only one chunk is held as text at a time
+def read_delimited_streaming(path, key=None, chunk_rows=INGEST_CHUNK_ROWS):
+    with open(path, "rb") as handle:
+        first_line = handle.readline()
+    sep = "\t" if first_line.count(b"\t") > first_line.count(b",") else ","
+    total_bytes = os.path.getsize(path) or 1
+    dtypes, optional_bools = sniff_column_types(path, sep, chunk_rows, key, total_bytes)
+    chunks = []
+    rows = 0
+    with open(path, "rb") as handle:
+        for chunk in pd.read_csv(handle, sep=sep, chunksize=chunk_rows, dtype=dtypes, encoding_errors="replace"):
+            for column in optional_bools:
+                # True/False with blanks stays an object column, as a single read_csv leaves it
+                chunk[column] = chunk[column].str.lower().map({"true": True, "false": False}).astype(object)
+            chunks.append(chunk)
+            rows += len(chunk)
+            report_progress(key, rows=rows, fraction=0.5 + min(handle.tell() / total_bytes, 1.0) / 2)
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+# Function to Work Out the Column Types of a Delimited File the Way a single read_csv would, from
+# the types pandas infers chunk by chunk: all-boolean columns bool, fully numeric columns numeric,
+# anything else (or chunks that disagree) text. Returns the dtypes to parse with and the boolean
+# columns that have blanks
+def sniff_column_types(path, sep, chunk_rows, key, total_bytes):
+    kinds, missing = {}, set()
+    with open(path, "rb") as handle:
+        for chunk in pd.read_csv(handle, sep=sep, chunksize=chunk_rows, encoding_errors="replace"):
+            for column in chunk.columns:
+                values = chunk[column]
+                kind = kinds.setdefault(column, None)
+                present = values.notna()
+                if not present.all():
+                    missing.add(column)
+                if kind == "text" or not present.any():
+                    continue
+                if values.dtype == bool or (values.dtype == object and values[present].map(type).eq(bool).all()):
+                    chunk_kind = "bool"
+                elif values.dtype.kind in "iuf":
+                    chunk_kind = values.dtype
+                else:
+                    chunk_kind = "text"
+                if kind is None or kind == chunk_kind:
+                    kinds[column] = chunk_kind
+                elif isinstance(kind, np.dtype) and isinstance(chunk_kind, np.dtype):
+                    kinds[column] = np.result_type(kind, chunk_kind)
+                else:
+                    kinds[column] = "text"
+            report_progress(key, rows=0, fraction=min(handle.tell() / total_bytes, 1.0) / 2)
+    dtypes, optional_bools = {}, []
+    for column, kind in kinds.items():
+        if kind is None:
+            continue  # Nothing but blanks: left to pandas, as a single read_csv would
+        elif kind == "text" or (kind == "bool" and column in missing):
+            dtypes[column] = str
+            if kind == "bool":
+                optional_bools.append(column)
+        elif kind == "bool":
+            dtypes[column] = "bool"
+        elif column in missing and kind.kind in "iu":
+            dtypes[column] = "float64"
+        else:
+            dtypes[column] = kind
+    return dtypes, optional_bools
+
+
+# Function to Parse an Uploaded File (xlsx streamed, legacy xls via pandas, anything else as CSV/TSV)
+def ingest_file(path, key=None, chunk_rows=INGEST_CHUNK_ROWS):
+    with open(path, "rb") as handle:
+        magic = handle.read(8)
+    report_progress(key, rows=0, fraction=0.0, done=False, error=None)
+    try:
+        if magic.startswith(b"PK"):
+            df = read_xlsx_streaming(path, key, chunk_rows)
+        elif magic.startswith(b"\xd0\xcf\x11\xe0"):
+            df = pd.read_excel(path)
+        else:
+            df = read_delimited_streaming(path, key, chunk_rows)
+    except Exception as e:
+        report_progress(key, done=True, error=str(e))
+        raise
+    report_progress(key, rows=len(df), fraction=1.0, done=True)
+    return df
+
+
+# Function to Read Excel File (or CSV/TSV) from a Stored Upload
+def parse_contents(dataset_id):
+    path = upload_path(dataset_id)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Dataset {dataset_id} is no longer available, please upload the file again")
+    with timed("parse"):
+        df = ingest_file(path, dataset_id)
+    stage_items.inc("parse", len(df))
+    return df
+
+
+# Parsed datasets shared by all callbacks, bounded by memory and age (LRU eviction)
+class DatasetCache:
+    def __init__(self, max_bytes=DATASET_CACHE_MAX_BYTES, ttl=DATASET_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, stored_at)
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._key_locks = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return value  # Too large to keep, hand it back uncached
+            self._entries[key] = (value, size, time.monotonic())
+            self._total_bytes += size
+            self._evict()
+            return value
+
+    def get_or_load(self, key, loader, sizer):
+        value = self.get(key)
+        if value is not None:
+            return value
+        # Only one thread parses a given upload; the others wait for its result
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                value = self.get(key)
+                if value is None:
+                    value = loader()
+                    self.put(key, value, sizer(value))
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+        return value
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (_, _, stored_at) in self._entries.items() if now - stored_at > self.ttl]:
+            self._remove(key)
+        while self._total_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+
+dataset_cache = DatasetCache()
+result_cache = DatasetCache(max_bytes=RESULT_CACHE_MAX_BYTES)
+index_cache = DatasetCache(max_bytes=INDEX_CACHE_MAX_BYTES)
+filter_cache = DatasetCache(max_bytes=FILTER_CACHE_MAX_BYTES)
+
+
+# Function to Check a Dataset ID (the SHA-256 of its upload) before it becomes part of a path.
+# IDs come back from client-side stores, so anything else is refused
+def check_dataset_id(dataset_id):
+    if not isinstance(dataset_id, str) or not re.fullmatch(r"[0-9a-f]{64}", dataset_id):
+        raise ValueError("Invalid dataset ID")
+    return dataset_id
+
+
+# Function to Get the Stored File of a Completed Upload
+def upload_path(dataset_id):
+    return os.path.join(UPLOAD_DIR, f"{check_dataset_id(dataset_id)}.data")
+
+
+# Function to Get the Spill File Path of a Dataset
+def spill_path(key):
+    return os.path.join(DATASET_SPILL_DIR, f"{check_dataset_id(key)}.arrow")
+
+
+# Function to Write a Parsed Dataset to an Uncompressed Arrow IPC File (so reloads can memory-map it)
+def spill_dataset(key, df):
+    if feather is None or not all(isinstance(col, str) for col in df.columns):
+        return
+    os.makedirs(DATASET_SPILL_DIR, exist_ok=True)
+    tmp_path = f"{spill_path(key)}.{uuid.uuid4().hex}.tmp"
+    try:
+        feather.write_feather(df, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, spill_path(key))
+    except Exception:
+        # Columns Arrow cannot represent (e.g. mixed numbers and text) are not spilled
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    cleanup_directory(DATASET_SPILL_DIR, ".arrow", DATASET_SPILL_MAX_AGE, DATASET_SPILL_MAX_BYTES)
+
+
+# Function to Read a Spilled Dataset through a Memory Map (None if it was never spilled)
+def read_spilled_dataset(key):
+    path = spill_path(key)
+    if feather is None or not os.path.exists(path):
+        return None
+    try:
+        df = feather.read_table(path, memory_map=True).to_pandas()
+    except (OSError, ValueError):
+        return None
+    os.utime(path)  # Recently used spills are kept longest
+    return df
+
+
+# Function to Remove Files Older than the Age Limit, then the Oldest Ones over the Size Limit
+def cleanup_directory(directory, suffix, max_age, max_bytes):
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(suffix)]
+    except FileNotFoundError:
+        return
+    now = time.time()
+    files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries), reverse=True)
+    total = 0
+    for mtime, size, path in files:
+        if now - mtime <= max_age and total + size <= max_bytes:
+            total += size
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Function to Load a Dataset from its Spill, or Parse the Upload and Spill it
+def read_dataset(dataset_id):
+    df = read_spilled_dataset(dataset_id)
+    if df is None:
+        df = parse_contents(dataset_id)
+        spill_dataset(dataset_id, df)
+    else:
+        report_progress(dataset_id, rows=len(df), fraction=1.0, done=True, error=None)
+    return df
+
+
+# Function to Get the Parsed DataFrame of a Dataset (parsed once, then served from cache)
+def load_dataset(dataset_id):
+    return dataset_cache.get_or_load(dataset_id, lambda: read_dataset(dataset_id), frame_size)
+
+
+# Chunked Upload Routes: the browser sends the raw file in pieces (resumable),
+# the server stores it once and answers with a dataset ID (SHA-256 of the file)
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+# Function to Get the Partial File of an Upload in Progress
+def partial_upload_path(upload_id):
+    return os.path.join(UPLOAD_DIR, f"{upload_id}.part")
+
+
+@app.server.route("/upload/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        return flask.jsonify(error="Invalid upload ID"), 400
+    path = partial_upload_path(upload_id)
+    return flask.jsonify(received=os.path.getsize(path) if os.path.exists(path) else 0)
+
+
+@app.server.route("/upload/<upload_id>", methods=["POST"])
+def upload_chunk(upload_id):
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        return flask.jsonify(error="Invalid upload ID"), 400
+    offset = flask.request.args.get("offset", 0, type=int)
+    if offset < 0:
+        return flask.jsonify(error="Invalid offset"), 400
+    length = flask.request.content_length or 0
+    if length > UPLOAD_MAX_CHUNK_BYTES or offset + length > UPLOAD_MAX_BYTES:
+        return flask.jsonify(error="Upload too large"), 413
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = partial_upload_path(upload_id)
+    received = os.path.getsize(path) if os.path.exists(path) else 0
+    if offset > received:
+        # A chunk went missing: tell the client where to resume from
+        return flask.jsonify(received=received), 409
+    with open(path, "r+b" if received else "wb") as handle:
+        handle.truncate(offset)  # A re-sent chunk replaces what was stored from that offset on
+        handle.seek(offset)
+        # Copy at most one chunk's worth, even when the client sent no Content-Length
+        limit = min(UPLOAD_MAX_CHUNK_BYTES, UPLOAD_MAX_BYTES - offset)
+        copied = 0
+        for block in iter(lambda: flask.request.stream.read(min(1024 * 1024, limit + 1 - copied)), b""):
+            copied += len(block)
+            if copied > limit:
+                handle.truncate(offset)
+                return flask.jsonify(error="Upload too large"), 413
+            handle.write(block)
+        received = handle.tell()
+    stage_items.inc("upload_bytes", received - offset)
+    return flask.jsonify(received=received)
+
+
+@app.server.route("/upload/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        return flask.jsonify(error="Invalid upload ID"), 400
+    path = partial_upload_path(upload_id)
+    details = flask.request.get_json(silent=True) or {}
+    expected_size = details.get("size")
+    if not os.path.exists(path):
+        return flask.jsonify(error="Unknown upload"), 404
+    received = os.path.getsize(path)
+    if expected_size is not None and received != expected_size:
+        return flask.jsonify(received=received, error="Upload is incomplete"), 409
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    dataset_id = digest.hexdigest()
+    if os.path.exists(upload_path(dataset_id)):
+        os.remove(path)  # Same file uploaded before
+        os.utime(upload_path(dataset_id))
+    else:
+        os.replace(path, upload_path(dataset_id))
+    cleanup_directory(UPLOAD_DIR, ".data", UPLOAD_MAX_AGE, UPLOAD_MAX_BYTES * 4)
+    cleanup_directory(UPLOAD_DIR, ".part", UPLOAD_MAX_AGE, UPLOAD_MAX_BYTES * 4)
+
+    # Start parsing datasets right away; callbacks asking for the dataset wait for this load
+    if details.get("kind", "dataset") == "dataset":
+        threading.Thread(target=load_dataset, args=(dataset_id,), daemon=True).start()
+    return flask.jsonify(dataset_id=dataset_id, size=received)
+
+
+# Function to Estimate the Memory Used by a DataFrame
+def frame_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# Per-column index: categorical codes, sorted distinct values with counts,
+# and an inverted index from each value to the (ascending) row positions holding it
+class ColumnIndex:
+    def __init__(self, series):
+        try:
+            codes, uniques = pd.factorize(series, sort=True)
+        except TypeError:  # Mixed types that cannot be ordered
+            codes, uniques = pd.factorize(series)
+        index_dtype = np.int32 if len(series) < 2 ** 31 else np.int64
+        self.codes = codes.astype(index_dtype)
+        self.values = pd.Index(uniques)
+        self.counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        self._order = np.argsort(self.codes, kind="stable").astype(index_dtype)
+        # Missing values have code -1 and sort first, so value k occupies order[offsets[k]:offsets[k + 1]]
+        self._offsets = np.concatenate(([0], np.cumsum(self.counts))) + int((codes < 0).sum())
+        self.options = [{"label": f"{value} ({count:,})", "value": value}
+                        for value, count in zip(self.values.tolist(), self.counts.tolist())]
+        self.nbytes = (self.codes.nbytes + self._order.nbytes + self._offsets.nbytes + self.counts.nbytes
+                       + int(self.values.memory_usage(deep=True)) + 64 * len(self.options))
+
+    def lookup(self, value):
+        try:
+            loc = self.values.get_loc(value)
+        except (KeyError, TypeError, ValueError):
+            return None
+        return int(loc) if isinstance(loc, (int, np.integer)) else None
+
+    def positions(self, value):
+        code = self.lookup(value)
+        if code is None:
+            return self._order[:0]
+        return self._order[self._offsets[code]:self._offsets[code + 1]]
+
+
+# Function to Get (building it on first use) the Index of One Dataset Column
+def get_column_index(key, df, column):
+    return index_cache.get_or_load((key, column), lambda: ColumnIndex(df[column]), lambda index: index.nbytes)
+
+
+# Filter operators offered for each dynamic filter
+FILTER_OPERATIONS = [
+    {"label": "is one of", "value": "in"},
+    {"label": "is not", "value": "ne"},
+    {"label": "between", "value": "range"},
+    {"label": "contains", "value": "contains"}
+]
+
+
+# Function to Build Filter Predicates from the Dynamic Filter Inputs (incomplete filters are skipped)
+def build_predicates(columns, operations, values, minimums, maximums, texts):
+    predicates = []
+    for col, op, vals, low, high, text in zip(columns, operations, values, minimums, maximums, texts):
+        op = op or "in"
+        if not col:
+            continue
+        if op in ("in", "ne") and vals not in (None, [], ""):
+            predicates.append({"column": col, "op": op, "values": vals if isinstance(vals, list) else [vals]})
+        elif op == "range" and (low not in (None, "") or high not in (None, "")):
+            predicates.append({"column": col, "op": op, "min": low, "max": high})
+        elif op == "contains" and text:
+            predicates.append({"column": col, "op": op, "text": text})
+    return predicates
+
+
+# Function to Get a Stable Key for One Predicate (used to memoize filter sets)
+def predicate_key(predicate):
+    return json.dumps(predicate, sort_keys=True, default=str)
+
+
+# Function to Convert a Range Bound to the Type of the Column's Values
+def coerce_bound(values, bound):
+    if bound in (None, ""):
+        return None
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return pd.Timestamp(bound)
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        return float(bound)
+    return str(bound)
+
+
+# Function to Evaluate a Predicate Once per Distinct Value of its Column.
+# Returns a mask over the index values plus one trailing entry for missing values,
+# so the row mask is simply value_mask[codes] and selectivity is exact from the counts.
+def predicate_value_mask(index, predicate):
+    values = index.values
+    op = predicate["op"]
+    if op in ("in", "ne"):
+        codes = [index.lookup(value) for value in predicate["values"]]
+        mask = np.zeros(len(values), dtype=bool)
+        mask[[code for code in codes if code is not None]] = True
+        if op == "ne":
+            return np.append(~mask, True)
+        return np.append(mask, False)
+    if op == "contains":
+        mask = values.astype(str).str.contains(str(predicate["text"]), case=False, regex=False)
+        return np.append(np.asarray(mask, dtype=bool), False)
+    if op == "range":
+        low, high = coerce_bound(values, predicate.get("min")), coerce_bound(values, predicate.get("max"))
+        comparable = values.astype(str) if isinstance(low or high, str) else values
+        mask = np.ones(len(values), dtype=bool)
+        if low is not None:
+            mask &= np.asarray(comparable >= low, dtype=bool)
+        if high is not None:
+            mask &= np.asarray(comparable <= high, dtype=bool)
+        return np.append(mask, False)
+    raise ValueError(f"Unknown filter operation: {op}")
+
+
+# Function to Find Row Positions Matching All Predicates.
+# Starts from the largest memoized subset of the same filters, then applies the
+# remaining predicates most-selective first, each only to the rows still matching.
+def evaluate_predicates(key, df, predicates):
+    wanted = {predicate_key(p): p for p in predicates}
+    best = None
+    for cached_key in filter_cache.keys():
+        dataset, filter_set = cached_key
+        if dataset == key and filter_set <= frozenset(wanted) and (best is None or len(filter_set) > len(best)):
+            best = filter_set
+    positions = filter_cache.get((key, best)) if best is not None else None
+    if positions is None:
+        best = frozenset()
+
+    steps = []
+    for p_key, predicate in wanted.items():
+        if p_key in best:
+            continue
+        index = get_column_index(key, df, predicate["column"])
+        value_mask = predicate_value_mask(index, predicate)
+        selectivity = float(value_mask[:-1] @ index.counts + value_mask[-1] * (len(df) - index.counts.sum())) / max(len(df), 1)
+        steps.append((selectivity, p_key, predicate, index, value_mask))
+    steps.sort(key=lambda step: step[0])
+
+    applied = set(best)
+    for selectivity, p_key, predicate, index, value_mask in steps:
+        if positions is None:
+            if predicate["op"] == "in":
+                # Most selective filter is an equality list: read its rows from the inverted index
+                positions = np.sort(np.concatenate([index.positions(v) for v in predicate["values"]] + [index.codes[:0]]))
+            else:
+                positions = np.flatnonzero(value_mask[index.codes])
+        elif len(positions):
+            positions = positions[value_mask[index.codes[positions]]]
+        applied.add(p_key)
+        filter_cache.put((key, frozenset(applied)), positions, positions.nbytes + 256)
+
+    if positions is None:
+        positions = np.arange(len(df))
+    return positions
+
+
+# Function to Apply Filter Predicates to a Dataset (one copy of the frame at the end)
+def filter_dataset(key, df, predicates):
+    if not predicates:
+        return df
+    return df.iloc[evaluate_predicates(key, df, predicates)]
+
+
+# Function to Get the Filtered Result of a Dataset (kept on the server, keyed by dataset + filters)
+def get_filtered_result(dataset_id, filters):
+    key = hashlib.sha256(json.dumps([dataset_id, sorted(map(predicate_key, filters))]).encode()).hexdigest()
+    return result_cache.get_or_load(key, lambda: timed_filter(dataset_id, filters), frame_size)
+
+
+# Function to Filter a Dataset, Recording the Filter Stage
+def timed_filter(dataset_id, filters):
+    df = load_dataset(dataset_id)
+    with timed("filter"):
+        result = filter_dataset(dataset_id, df, filters)
+    stage_items.inc("filter", len(df))
+    return result
+
+
+# Function to Split a DataTable filter_query Part into (column, operator, value).
+# The part is matched as a whole, so operator words inside column names or values are left alone
+FILTER_OPERATORS = {">=": "ge", "<=": "le", "<": "lt", ">": "gt", "!=": "ne", "=": "eq"}
+FILTER_PART_PATTERN = re.compile(
+    r"^\{(?P<col>[^}]*)\}\s+(?P<op>ge|>=|le|<=|lt|<|gt|>|ne|!=|eq|=|contains|datestartswith)\s+(?P<val>.*)$",
+    re.DOTALL
+)
+
+
+def split_filter_part(filter_part):
+    match = FILTER_PART_PATTERN.match(filter_part.strip())
+    if not match:
+        return [None] * 3
+    name, value_part = match["col"], match["val"].strip()
+    operator = FILTER_OPERATORS.get(match["op"], match["op"])
+    v0 = value_part[0] if value_part else ""
+    if len(value_part) > 1 and v0 == value_part[-1] and v0 in ("'", '"', "`"):
+        value = value_part[1: -1].replace("\\" + v0, v0)
+    elif operator in ("contains", "datestartswith"):
+        value = value_part
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    return name, operator, value
+
+
+# Function to Apply the Table's Own Column Filters and Sorting to a Result.
+# Filter parts that do not fit their column's type, and sorts that fail, are skipped and reported;
+# returns the view and the list of problems
+def apply_table_query(df, filter_query, sort_by):
+    problems = []
+    for filter_part in (filter_query or "").split(" && "):
+        if not filter_part.strip():
+            continue
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name is None:
+            problems.append(f"Filter \"{filter_part.strip()}\" ignored: it could not be read")
+            continue
+        if col_name not in df.columns:
+            problems.append(f"Filter on {col_name} ignored: no such column")
+            continue
+        column = df[col_name]
+        try:
+            if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+                if pd.api.types.is_datetime64_any_dtype(column):
+                    filter_value = pd.Timestamp(filter_value)
+                elif pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+                    if isinstance(filter_value, str):
+                        problems.append(f"Filter on {col_name} ignored: it holds numbers, not \"{filter_value}\"")
+                        continue
+                elif isinstance(filter_value, float):
+                    column = pd.to_numeric(column, errors="coerce")
+                df = df.loc[getattr(column, operator)(filter_value)]
+            elif operator == "contains":
+                df = df.loc[column.astype(str).str.contains(str(filter_value), case=False, regex=False, na=False)]
+            elif operator == "datestartswith":
+                df = df.loc[column.astype(str).str.startswith(str(filter_value), na=False)]
+        except (TypeError, ValueError) as e:
+            problems.append(f"Filter on {col_name} ignored: {e}")
+    sort_columns = [col for col in sort_by or [] if col["column_id"] in df.columns]
+    if sort_columns:
+        try:
+            # Columns mixing numbers and text (common in Excel exports) are sorted as text
+            df = df.sort_values(
+                [col["column_id"] for col in sort_columns],
+                ascending=[col["direction"] == "asc" for col in sort_columns],
+                kind="stable",
+                key=lambda values: values.astype(str) if values.dtype == object else values
+            )
+        except (TypeError, ValueError) as e:
+            problems.append(f"Sorting ignored: {e}")
+    return df, problems
+
+
+# Function to Get What the Table Shows (filtered result + table filter/sort) and the table query's
+# problems, cached per view
+def get_table_query(dataset_id, filters, filter_query=None, sort_by=None):
+    result = get_filtered_result(dataset_id, filters)
+    if not filter_query and not sort_by:
+        return result, []
+    key = hashlib.sha256(json.dumps([dataset_id, filters, filter_query, sort_by], default=str).encode()).hexdigest()
+    return result_cache.get_or_load(key, lambda: timed_table_query(result, filter_query, sort_by),
+                                    lambda view: frame_size(view[0]))
+
+
+# Function to Get What the Table Shows (used by everything that acts on the visible rows)
+def get_table_view(dataset_id, filters, filter_query=None, sort_by=None):
+    return get_table_query(dataset_id, filters, filter_query, sort_by)[0]
+
+
+# Function to Apply the Table Query, Recording the Query Stage
+def timed_table_query(result, filter_query, sort_by):
+    with timed("table_query"):
+        return apply_table_query(result, filter_query, sort_by)
 
 # Callback to display uploaded file name
 @app.callback(
     Output("uploaded-file-name", "children"),
-    Input("upload-excel", "filename")
+    Input("dataset-filename", "data")
 )
 def update_filename(filename):
     if filename:
         return f"Uploaded File: {filename}"
     return ""
 
+# Callback to Start Polling Ingestion Progress for a New Upload
+@app.callback(
+    [Output("upload-status", "children"), Output("ingest-poll", "disabled")],
+    Input("dataset-id", "data")
+)
+def start_ingest_progress(dataset_id):
+    return "", not dataset_id
+
+
+# Callback to Show Ingestion Progress
+@app.callback(
+    [Output("ingest-progress", "children"), Output("ingest-poll", "disabled", allow_duplicate=True)],
+    Input("ingest-poll", "n_intervals"),
+    State("dataset-id", "data"),
+    prevent_initial_call=True
+)
+def show_ingest_progress(n_intervals, key):
+    with ingest_progress_lock:
+        progress = dict(ingest_progress.get(key) or {})
+    if not progress:
+        if dataset_cache.get(key) is not None:
+            return "", True
+        return "⏳ Loading data...", False
+    if progress["error"]:
+        return f"❌ Could not read file: {progress['error']}", True
+    if progress["done"]:
+        return f"✅ Loaded {progress['rows']:,} rows", True
+    percent = f" ({progress['fraction']:.0%})" if progress["fraction"] is not None else ""
+    return f"⏳ Loading data... {progress['rows']:,} rows{percent}", False
+
+
 # Callback to Toggle Password Visibility
 @app.callback(
     Output("sender-password", "type"),
@@ -304,13 +1402,13 @@ def toggle_password_visibility(n_clicks, password_type):
     Output("filters-container", "children"),
     [Input("add-filter-btn", "n_clicks"), Input({"type": "remove-filter", "index": dash.ALL}, "n_clicks")],
     State("filters-container", "children"),
-    State("upload-excel", "contents")
+    State("dataset-id", "data")
 )
-def update_filters(add_clicks, remove_clicks, existing_filters, contents):
-    if not contents:
+def update_filters(add_clicks, remove_clicks, existing_filters, dataset_id):
+    if not dataset_id:
         return existing_filters  # No file uploaded, return unchanged
 
-    df = parse_contents(contents)
+    df = load_dataset(dataset_id)
     triggered_id = ctx.triggered_id
 
     if isinstance(triggered_id, dict) and triggered_id["type"] == "remove-filter":
@@ -327,8 +1425,29 @@ def update_filters(add_clicks, remove_clicks, existing_filters, contents):
                 options=[{"label": col, "value": col} for col in df.columns],
                 placeholder="Select a column"
             ),
-            html.Label(f"Filter {filter_id + 1} Value"),
-            dcc.Dropdown(id={"type": "filter-value", "index": filter_id}, placeholder="Select a value", disabled=True),
+            html.Label(f"Filter {filter_id + 1} Condition"),
+            dcc.Dropdown(
+                id={"type": "filter-operation", "index": filter_id},
+                options=FILTER_OPERATIONS,
+                value="in",
+                clearable=False
+            ),
+            html.Div([
+                html.Label(f"Filter {filter_id + 1} Values"),
+                dcc.Dropdown(id={"type": "filter-value", "index": filter_id}, placeholder="Select one or more values",
+                             multi=True, disabled=True)
+            ], id={"type": "filter-value-box", "index": filter_id}),
+            html.Div([
+                html.Label(f"Filter {filter_id + 1} Range"),
+                dbc.Row([
+                    dbc.Col(dbc.Input(id={"type": "filter-min", "index": filter_id}, placeholder="From"), width=6),
+                    dbc.Col(dbc.Input(id={"type": "filter-max", "index": filter_id}, placeholder="To"), width=6)
+                ])
+            ], id={"type": "filter-range-box", "index": filter_id}, style={"display": "none"}),
+            html.Div([
+                html.Label(f"Filter {filter_id + 1} Text"),
+                dbc.Input(id={"type": "filter-text", "index": filter_id}, placeholder="Text to search for")
+            ], id={"type": "filter-text-box", "index": filter_id}, style={"display": "none"}),
             html.Button("Remove", id={"type": "remove-filter", "index": filter_id}, className="btn btn-danger btn-sm mt-2"),
             html.Hr()
         ])
@@ -338,25 +1457,40 @@ def update_filters(add_clicks, remove_clicks, existing_filters, contents):
 
 
 
+# Callback to Show the Inputs Matching Each Filter's Condition
+@app.callback(
+    [Output({"type": "filter-value-box", "index": dash.MATCH}, "style"),
+     Output({"type": "filter-range-box", "index": dash.MATCH}, "style"),
+     Output({"type": "filter-text-box", "index": dash.MATCH}, "style")],
+    Input({"type": "filter-operation", "index": dash.MATCH}, "value")
+)
+def toggle_filter_inputs(operation):
+    hidden, shown = {"display": "none"}, {"display": "block"}
+    return (
+        shown if operation in ("in", "ne", None) else hidden,
+        shown if operation == "range" else hidden,
+        shown if operation == "contains" else hidden
+    )
+
+
 # Callback to Populate Values for Selected Columns Dynamically
 @app.callback(
     Output({"type": "filter-value", "index": dash.ALL}, "options"),
     Output({"type": "filter-value", "index": dash.ALL}, "disabled"),
     Input({"type": "filter-column", "index": dash.ALL}, "value"),
-    State("upload-excel", "contents")
+    State("dataset-id", "data")
 )
-def update_filter_values(selected_columns, contents):
-    if not contents:
+def update_filter_values(selected_columns, dataset_id):
+    if not dataset_id:
         return [[]] * len(selected_columns), [True] * len(selected_columns)
 
-    df = parse_contents(contents)
+    df = load_dataset(dataset_id)
     updated_options = []
     updated_disabled = []
 
     for column in selected_columns:
         if column:
-            values = [{"label": val, "value": val} for val in df[column].dropna().unique()]
-            updated_options.append(values)
+            updated_options.append(get_column_index(dataset_id, df, column).options)
             updated_disabled.append(False)
         else:
             updated_options.append([])
@@ -365,119 +1499,1372 @@ def update_filter_values(selected_columns, contents):
     return updated_options, updated_disabled
 
 
-# Callback to Apply Multiple Filters
+# Callback to Apply Multiple Filters (the result stays on the server; the table pages through it)
 @app.callback(
-    [Output("filtered-table", "columns"), Output("filtered-table", "data")],
+    [Output("filtered-table", "columns"), Output("filtered-result", "data"), Output("filtered-table", "page_current"),
+     Output("filter-error", "children")],
     Input("apply-filters-btn", "n_clicks"),
-    [State("upload-excel", "contents"), State({"type": "filter-column", "index": dash.ALL}, "value"),
-     State({"type": "filter-value", "index": dash.ALL}, "value")]
+    [State("dataset-id", "data"), State({"type": "filter-column", "index": dash.ALL}, "value"),
+     State({"type": "filter-operation", "index": dash.ALL}, "value"),
+     State({"type": "filter-value", "index": dash.ALL}, "value"),
+     State({"type": "filter-min", "index": dash.ALL}, "value"),
+     State({"type": "filter-max", "index": dash.ALL}, "value"),
+     State({"type": "filter-text", "index": dash.ALL}, "value")]
 )
-def apply_filters(n_clicks, contents, filter_columns, filter_values):
-    if not contents:
-        return [], []
+def apply_filters(n_clicks, dataset_id, filter_columns, filter_operations, filter_values, filter_minimums,
+                  filter_maximums, filter_texts):
+    if not dataset_id:
+        return [], None, 0, ""
+
+    filters = build_predicates(filter_columns, filter_operations, filter_values, filter_minimums, filter_maximums, filter_texts)
+    try:
+        df = get_filtered_result(dataset_id, filters)
+    except ValueError as e:
+        return dash.no_update, dash.no_update, dash.no_update, f"⚠️ Invalid filter: {e}"
+    return [{"name": i, "id": i} for i in df.columns], {"filters": filters}, 0, ""
+
+
+# Callback to Send One Page of the Filtered Result to the Table
+@app.callback(
+    [Output("filtered-table", "data"), Output("filtered-table", "page_count"), Output("filtered-row-count", "children"),
+     Output("filtered-table", "page_current", allow_duplicate=True),
+     Output("filter-error", "children", allow_duplicate=True)],
+    [Input("filtered-result", "data"), Input("filtered-table", "page_current"), Input("filtered-table", "page_size"),
+     Input("filtered-table", "sort_by"), Input("filtered-table", "filter_query")],
+    State("dataset-id", "data"),
+    prevent_initial_call="initial_duplicate"
+)
+def update_table_page(result, page_current, page_size, sort_by, filter_query, dataset_id):
+    if not dataset_id or not result:
+        return [], 0, "", dash.no_update, dash.no_update
+
+    df, problems = get_table_query(dataset_id, result["filters"], filter_query, sort_by)
+    total = len(load_dataset(dataset_id))
+    page_count = max(1, -(-len(df) // page_size))
+    # A narrower table filter can leave fewer pages than the one shown: move to the last page
+    page = min(page_current or 0, page_count - 1)
+    start = page * page_size
+    rows = df.iloc[start:start + page_size]
+    with timed("serialize"):
+        records = rows.to_dict("records")
+    return (records, page_count,
+            f"Showing {len(rows)} of {len(df):,} matching rows ({total:,} rows in file)",
+            page if page != page_current else dash.no_update,
+            "; ".join(f"⚠️ {problem}" for problem in problems))
+
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet"
+}
+XLSX_MAX_ROWS = 1048576
+
+
+# Function to Write an Xlsx Export Row by Row in xlsxwriter's constant_memory mode
+# (only the current row is held in memory; rows past the sheet limit continue on a new sheet)
+def write_xlsx_export(df, path):
+    with xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_urls": False,
+                                    "strings_to_formulas": False, "nan_inf_to_errors": True}) as workbook:
+        header_format = workbook.add_format({"bold": True})
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        worksheet = None
+        row = XLSX_MAX_ROWS
+        for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+            chunk = chunk.where(chunk.notna(), None)
+            for values in chunk.itertuples(index=False, name=None):
+                if row >= XLSX_MAX_ROWS:
+                    sheet = len(workbook.worksheets()) + 1
+                    worksheet = workbook.add_worksheet("Filtered Data" if sheet == 1 else f"Filtered Data ({sheet})")
+                    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+                    row = 1
+                for col, value in enumerate(values):
+                    if value is None:
+                        continue
+                    if isinstance(value, (pd.Timestamp, date)):
+                        worksheet.write_datetime(row, col, value.replace(tzinfo=None) if hasattr(value, "tzinfo") else value,
+                                                 date_format)
+                    elif isinstance(value, (str, int, float, bool, np.number, np.bool_)):
+                        worksheet.write(row, col, value)
+                    else:
+                        worksheet.write_string(row, col, str(value))
+                row += 1
+        if worksheet is None:
+            workbook.add_worksheet("Filtered Data").write_row(0, 0, [str(col) for col in df.columns], header_format)
+
+
+# Function to Write a Parquet Export; object columns mixing types are written as text
+def write_parquet_export(df, path):
+    df = df.rename(columns=str)
+    try:
+        df.to_parquet(path, index=False)
+    except (TypeError, ValueError, ArithmeticError):
+        mixed = [col for col in df.columns if df[col].dtype == object]
+        df.astype({col: "string" for col in mixed}).to_parquet(path, index=False)
+
+
+# Function to Write an Export File (to a temporary name first, so a reader never sees half a file)
+def write_export(df, fmt, path):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        if fmt == "xlsx":
+            write_xlsx_export(df, tmp_path)
+        elif fmt == "csv":
+            df.to_csv(tmp_path, index=False, chunksize=EXPORT_CHUNK_ROWS)
+        else:
+            write_parquet_export(df, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    cleanup_directory(EXPORT_DIR, ".export", EXPORT_MAX_AGE, EXPORT_MAX_BYTES)
 
-    df = parse_contents(contents)
-    for col, val in zip(filter_columns, filter_values):
-        if col and val:
-            df = df[df[col] == val]
 
-    return [{"name": i, "id": i} for i in df.columns], df.to_dict("records")
+# Streams a finished export from disk (the browser is sent here by the download callback)
+@app.server.route("/export/<export_id>/<filename>")
+def download_export(export_id, filename):
+    fmt = filename.rsplit(".", 1)[-1]
+    path = os.path.join(EXPORT_DIR, f"{export_id}.export")
+    if not re.fullmatch(r"[0-9a-f]{64}", export_id) or fmt not in EXPORT_FORMATS or not os.path.exists(path):
+        return flask.jsonify(error="Unknown export"), 404
+    return flask.send_file(path, mimetype=EXPORT_FORMATS[fmt], as_attachment=True, download_name=filename)
 
 
-# Callback to Download Filtered Data
+# Callback to Download Filtered Data: the export is written on the server from the filtered
+# result, and only its URL goes back to the browser
 @app.callback(
-    Output("download-dataframe-xlsx", "data"),
+    Output("export-url", "data"),
     Input("download-btn", "n_clicks"),
-    State("filtered-table", "data")
+    [State("dataset-id", "data"), State("filtered-result", "data"),
+     State("filtered-table", "filter_query"), State("filtered-table", "sort_by"), State("download-format", "value")]
 )
-def download_filtered_data(n_clicks, data):
-    if n_clicks is None or not data:
+def download_filtered_data(n_clicks, dataset_id, result, filter_query, sort_by, fmt):
+    if n_clicks is None or not dataset_id or not result or fmt not in EXPORT_FORMATS:
         return dash.no_update
 
-    df = pd.DataFrame(data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="Filtered Data")
+    df = get_table_view(dataset_id, result["filters"], filter_query, sort_by)
+    if df.empty:
+        return dash.no_update
+    export_id = hashlib.sha256(json.dumps([dataset_id, result["filters"], filter_query, sort_by, fmt],
+                                          sort_keys=True, default=str).encode()).hexdigest()
+    path = os.path.join(EXPORT_DIR, f"{export_id}.export")
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        with timed(f"export_{fmt}"):
+            write_export(df, fmt, path)
+        stage_items.inc(f"export_{fmt}_rows", len(df))
+    return f"{app.get_relative_path('/export')}/{export_id}/filtered_data.{fmt}?n={n_clicks}"
 
-    output.seek(0)
-    return dcc.send_bytes(output.getvalue(), "filtered_data.xlsx")
+
+# Starts the browser download of a finished export
+app.clientside_callback(
+    """
+    function (url) {
+        if (url) {
+            var link = document.createElement("a");
+            link.href = url;
+            link.download = "";
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+        }
+        return "";
+    }
+    """,
+    Output("export-download", "children"),
+    Input("export-url", "data"),
+    prevent_initial_call=True
+)
 
 
 # Populate Dropdowns with Column Names
 @app.callback(
     [Output("name-column-1", "options"), Output("email-column-1", "options"),
-     Output("name-column-2", "options"), Output("email-column-2", "options")],
-    Input("upload-excel", "contents")
+     Output("name-column-2", "options"), Output("email-column-2", "options"),
+     Output("attachment-column", "options")],
+    Input("dataset-id", "data")
 )
-def populate_dropdowns(contents):
-    if not contents:
-        return [], [], [], []
-    df = parse_contents(contents)
+def populate_dropdowns(dataset_id):
+    if not dataset_id:
+        return [], [], [], [], []
+    df = load_dataset(dataset_id)
     columns = [{"label": col, "value": col} for col in df.columns]
-    return columns, columns, columns, columns
+    return columns, columns, columns, columns, columns
+
+
+# Token bucket limiting one sender account (messages per second and per day),
+# slowing down further whenever the server answers 421/451
+class RateLimiter:
+    def __init__(self, rate=SENDER_RATE_PER_SECOND, daily_limit=SENDER_DAILY_LIMIT, max_backoff=SENDER_MAX_BACKOFF):
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._day = date.today()
+        self._sent_today = 0
+        self._backoff = 0.0
+        self._paused_until = 0.0
+        self.configure(rate, daily_limit)
+
+    def configure(self, rate, daily_limit):
+        with self._lock:
+            self.max_rate = max(float(rate or SENDER_RATE_PER_SECOND), 0.01)
+            self.rate = self.max_rate
+            self.daily_limit = int(daily_limit or SENDER_DAILY_LIMIT)
+
+    def remaining_today(self):
+        with self._lock:
+            self._roll_day()
+            return max(self.daily_limit - self._sent_today, 0)
+
+    # Blocks until a message may be sent; False if the daily quota is used up or should_stop() says so
+    def acquire(self, should_stop=None):
+        while True:
+            with self._lock:
+                self._roll_day()
+                if self._sent_today >= self.daily_limit:
+                    return False
+                now = time.monotonic()
+                self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._sent_today += 1
+                    return True
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if should_stop and should_stop():
+                return False
+            time.sleep(min(wait, 0.5))
+
+    # Server pushed back: halve the rate and pause the whole account for an increasing delay
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.rate / 2, self.max_rate / 64)
+            self._backoff = min(max(self._backoff * 2, 1.0), self.max_backoff)
+            self._paused_until = max(self._paused_until, time.monotonic() + self._backoff)
+            return self._backoff
+
+    # Recover additively towards the configured rate after successful sends
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.rate + self.max_rate / 10, self.max_rate)
+            self._backoff = self._backoff / 2 if self._backoff > 1 else 0.0
+
+    def _roll_day(self):
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self._sent_today = 0
+
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+# Function to Get the Shared Rate Limiter of a Sender Account
+def get_rate_limiter(account, rate=None, daily_limit=None):
+    key = (account or "").strip().lower()
+    with rate_limiters_lock:
+        limiter = rate_limiters.get(key)
+        if limiter is None:
+            limiter = rate_limiters[key] = RateLimiter(rate, daily_limit)
+        elif rate or daily_limit:
+            limiter.configure(rate or limiter.max_rate, daily_limit or limiter.daily_limit)
+        return limiter
+
+
+# SMTP connection reused for many messages (one login per batch)
+class SMTPSession:
+    def __init__(self, username, password, host=SMTP_HOST, port=SMTP_PORT, use_tls=SMTP_USE_TLS,
+                 max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION, keepalive_interval=SMTP_KEEPALIVE_INTERVAL,
+                 max_retries=SMTP_MAX_RETRIES, timeout=SMTP_TIMEOUT, rate_limiter=None):
+        self.username = username
+        self.password = password
+        self.host = host or SMTP_HOST
+        self.port = int(port or SMTP_PORT)
+        self.use_tls = use_tls
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self._server = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+
+    def __enter__(self):
+        if self._server is None:
+            self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def connect(self):
+        self.close()
+        with timed("connect"):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                with timed("starttls"):
+                    server.starttls()
+            if self.username and self.password:
+                with timed("login"):
+                    server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self._sent_on_connection = 0
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            self._server.close()
+        self._server = None
+
+    def _ensure_connected(self):
+        if self._server is None or self._sent_on_connection >= self.max_messages:
+            self.connect()
+        elif time.monotonic() - self._last_used > self.keepalive_interval:
+            # Idle connection: check it is still alive before sending on it
+            try:
+                code, _ = self._server.noop()
+            except (smtplib.SMTPException, OSError):
+                code = None
+            if code != 250:
+                self.connect()
+
+    def send(self, msg):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._ensure_connected()
+                with timed("send"):
+                    self._server.send_message(msg)
+                self._sent_on_connection += 1
+                self._last_used = time.monotonic()
+                if self.rate_limiter:
+                    self.rate_limiter.succeeded()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                self.close()
+                if attempt == self.max_retries:
+                    raise
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code not in SMTP_RETRY_CODES or attempt == self.max_retries:
+                    raise
+                # Throttled or per-connection limit reached: back off, reconnect and retry
+                self.close()
+                time.sleep(self.rate_limiter.throttled() if self.rate_limiter else min(2 ** attempt, 30))
 
 
-# Function to Send Email
-def send_email(sender_email, sender_password, to_email, subject, body):
-    SMTP_SERVER = "smtp.gmail.com"
-    SMTP_PORT = 587
+# Function to Build an Email Message
+def build_message(sender_email, to_email, subject, body, attachments=()):
     msg = EmailMessage()
     msg["From"] = sender_email
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.set_content(body)
+    if attachments:
+        # Parts are already base64-encoded (see encode_attachment), so they are attached as-is
+        msg.make_mixed()
+        for part in attachments:
+            msg.attach(part)
+    return msg
+
+
+class AttachmentError(ValueError):
+    pass
+
+
+# Function to Get the Stored File of an Attachment (its ID comes from the client's attachment list)
+def attachment_path(attachment_id, filename):
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
-        return f"✅ Email sent to {to_email}"
-    except Exception as e:
-        return f"❌ Failed to send email to {to_email}: {e}"
+        return upload_path(attachment_id)
+    except ValueError:
+        raise AttachmentError(f"Attachment {filename} has an invalid ID, please upload it again")
+
+
+# Function to Read and MIME-Encode an Uploaded File Once (the part is reused in every message)
+def encode_attachment(attachment_id, filename):
+    path = attachment_path(attachment_id, filename)
+    if not os.path.exists(path):
+        raise AttachmentError(f"Attachment {filename} is no longer available, please upload it again")
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    maintype, subtype = content_type.split("/", 1)
+    with open(path, "rb") as handle:
+        data = handle.read()
+    part = MIMEPart()
+    part.set_content(data, maintype=maintype, subtype=subtype, filename=filename)
+    return part
+
+
+attachment_cache = DatasetCache(max_bytes=ATTACHMENT_CACHE_MAX_BYTES)
+
+
+# Attachments of one send job: shared parts are encoded when the job is built; per-row parts
+# are encoded on first use and served from a byte-bounded LRU cache, so memory stays capped
+class JobAttachments:
+    def __init__(self, shared=(), per_row=()):
+        self.shared = [encode_attachment(a["id"], a["filename"]) for a in shared]
+        self.per_row = {a["filename"]: a["id"] for a in per_row}
+        for filename, attachment_id in self.per_row.items():
+            attachment_path(attachment_id, filename)  # Bad IDs fail the job before anything is sent
+
+    def parts_for(self, filenames=()):
+        parts = list(self.shared)
+        for filename in filenames:
+            attachment_id = self.per_row[filename]
+            # Keyed by name too: the encoded part carries the file name, and identical files may differ in name
+            parts.append(attachment_cache.get_or_load(
+                (attachment_id, filename), lambda: encode_attachment(attachment_id, filename),
+                lambda part: len(part.get_payload())
+            ))
+        return parts
+
+
+# Function to Split a Per-row Attachment Column into File Name Lists (";" or "," separated).
+# Names must match uploaded per-row files (case-insensitive); unknown names fail the job up front
+def row_attachment_names(values, per_row):
+    known = {filename.lower(): filename for filename in per_row}
+    names = (values.astype(str).where(values.notna(), "")
+             .str.split(r"[;,]").map(lambda parts: [p.strip() for p in parts if p.strip()]))
+    missing = sorted({name for parts in names for name in parts if name.lower() not in known})
+    if missing:
+        raise AttachmentError(f"Per-row attachment file(s) not uploaded: {', '.join(missing[:10])}"
+                              + (f" and {len(missing) - 10} more" if len(missing) > 10 else ""))
+    return names.map(lambda parts: [known[name.lower()] for name in parts])
+
+
+# Placeholders that do not come from a column; {designation} is kept for older templates
+TEMPLATE_BUILTINS = ("employee_name", "company_name", "sender_name", "designation")
+TEMPLATE_PREVIEW_ROWS = int(os.environ.get("TEMPLATE_PREVIEW_ROWS", 5))
+RECIPIENT_ISSUES_SHOWN = int(os.environ.get("RECIPIENT_ISSUES_SHOWN", 1000))
+
+
+class TemplateError(ValueError):
+    pass
+
+
+# Email template compiled once per job: placeholders are parsed and checked against the
+# dataset columns up front, then bodies are rendered column-wise for all rows at once
+class CompiledTemplate:
+    def __init__(self, template, df):
+        self.template = template or ""
+        self.pieces = []  # (literal text, placeholder or None, format spec, conversion)
+        try:
+            parsed = list(string.Formatter().parse(self.template))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}")
+        available = set(df.columns)
+        unknown = []
+        for literal, field, spec, conversion in parsed:
+            if field is not None:
+                if field == "" or field.isdigit():
+                    raise TemplateError("Placeholders must be named, e.g. {employee_name}")
+                if field not in TEMPLATE_BUILTINS and field not in available:
+                    unknown.append(field)
+            self.pieces.append((literal, field, spec, conversion))
+        if unknown:
+            raise TemplateError(
+                f"Unknown placeholder(s): {', '.join('{' + f + '}' for f in dict.fromkeys(unknown))}. "
+                f"Use {', '.join('{' + b + '}' for b in TEMPLATE_BUILTINS[:3])} or a column name."
+            )
+        self.fields = [field for _, field, _, _ in self.pieces if field is not None]
+        for _, field, spec, conversion in self.pieces:
+            if field is not None and (spec or conversion):
+                self._check_spec(df, field, spec, conversion)
+
+    # Formats a sample value (first non-empty cell of the column, "" for the text built-ins) with
+    # the placeholder's spec, so a bad spec fails here rather than part-way through rendering
+    def _check_spec(self, df, field, spec, conversion):
+        column = "Designation" if field == "designation" and field not in df.columns else field
+        if column in df.columns and field not in TEMPLATE_BUILTINS[:3]:
+            present = df[column].dropna()
+            if present.empty:
+                return
+            sample = present.iloc[0]
+        else:
+            sample = ""
+        try:
+            self._as_text(sample, spec, conversion)
+        except (ValueError, TypeError) as e:
+            raise TemplateError(f"Invalid format for {{{field}:{spec}}}: {e}")
+
+    # Renders one body per row of df. Placeholders are filled from the columns of the same
+    # name, from `values` (scalars or Series aligned with df) or, for {designation}, the Designation column
+    def render(self, df, values):
+        bodies = pd.Series("", index=df.index, dtype=object)
+        for literal, field, spec, conversion in self.pieces:
+            if literal:
+                bodies = bodies + literal
+            if field is None:
+                continue
+            if field in values:
+                value = values[field]
+            elif field in df.columns:
+                value = df[field]
+            else:
+                value = df["Designation"] if field == "designation" and "Designation" in df.columns else ""
+            try:
+                bodies = bodies + self._as_text(value, spec, conversion)
+            except (ValueError, TypeError) as e:
+                raise TemplateError(f"Invalid format for {{{field}:{spec}}}: {e}")
+        return bodies
+
+    @staticmethod
+    def _as_text(value, spec, conversion):
+        if isinstance(value, pd.Series):
+            if spec or conversion:
+                return value.map(lambda v: "" if pd.isna(v) else format(repr(v) if conversion == "r" else v, spec or ""))
+            return value.astype(str).where(value.notna(), "")
+        if value is None:
+            return ""
+        return format(repr(value) if conversion == "r" else value, spec or "")
+
+
+# Syntax check for addresses (RFC 5322 dot-atom local part, dotted domain with a 2+ letter TLD)
+EMAIL_PATTERN = (r"^[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+                 r"@(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$")
+RECIPIENT_ISSUES = ("empty", "malformed", "duplicate")
+
+
+# Function to Normalize and Check the Selected Email Columns (vectorized, before anything is sent).
+# One row per (data row, column pair): the trimmed address, its normalized form, and an issue
+# (empty, malformed, or duplicate of an earlier valid address in either pair), None when sendable
+def check_recipients(df, name_email_pairs):
+    parts = []
+    for pair, (name_col, email_col) in enumerate(name_email_pairs):
+        if not name_col or not email_col:
+            continue
+        raw = df[email_col]
+        address = raw.astype(str).str.strip().where(raw.notna(), "")
+        parts.append(pd.DataFrame({
+            "row": np.arange(len(df)),
+            "pair": pair,
+            "column": email_col,
+            "address": address.to_numpy(),
+            "normalized": address.str.lower().to_numpy()
+        }))
+    if not parts:
+        return pd.DataFrame(columns=["row", "pair", "column", "address", "normalized", "issue"])
+    recipients = pd.concat(parts, ignore_index=True).sort_values(["row", "pair"], kind="stable", ignore_index=True)
+    empty = recipients["address"] == ""
+    malformed = ~empty & ~recipients["normalized"].str.match(EMAIL_PATTERN)
+    valid = ~empty & ~malformed
+    duplicate = valid & recipients["normalized"].where(valid).duplicated()
+    recipients["issue"] = np.select([empty, malformed, duplicate], list(RECIPIENT_ISSUES), None)
+    return recipients
+
+
+# Function to Summarize Recipient Checks per Email Column
+def summarize_recipients(recipients):
+    summary = (recipients.assign(issue=recipients["issue"].fillna("valid"))
+               .pivot_table(index="column", columns="issue", values="row", aggfunc="count", fill_value=0)
+               .reindex(columns=["valid", *RECIPIENT_ISSUES], fill_value=0)
+               .rename_axis(columns=None)
+               .reset_index())
+    return summary.rename(columns=str.capitalize)
+
+
+# Function to Build Send Tasks for Both Name/Email Column Pairs, in Row Order.
+# Only valid, first-seen addresses get a task: (address, body, normalized address, per-row files).
+# Returns the tasks and the recipient check they were built from
+def build_send_tasks(df, template, name_email_pairs, company_name, sender_name,
+                     attachment_column=None, per_row_files=()):
+    compiled = CompiledTemplate(template, df)
+    recipients = check_recipients(df, name_email_pairs)
+    sendable = recipients[recipients["issue"].isna()]
+    if attachment_column:
+        files = row_attachment_names(df[attachment_column].iloc[sendable["row"].to_numpy()], per_row_files).tolist()
+    else:
+        files = [()] * len(sendable)
+    with timed("render"):
+        bodies = render_bodies(df, compiled, sendable, name_email_pairs, company_name, sender_name)
+    stage_items.inc("render", len(bodies))
+    tasks = list(zip(sendable["address"].tolist(), bodies.tolist(), sendable["normalized"].tolist(), files))
+    return tasks, recipients
+
+
+# Function to Render the Body of Every Sendable Recipient (column-wise, one pass per column pair)
+def render_bodies(df, compiled, sendable, name_email_pairs, company_name, sender_name):
+    bodies = pd.Series("", index=sendable.index, dtype=object)
+    for pair, group in sendable.groupby("pair"):
+        name_col = name_email_pairs[pair][0]
+        rows = df.iloc[group["row"].to_numpy()]
+        names = rows[name_col].astype(str).where(rows[name_col].notna(), "Employee")
+        rendered = compiled.render(rows, {"employee_name": names, "company_name": company_name or "",
+                                          "sender_name": sender_name or ""})
+        bodies.loc[group.index] = rendered.to_numpy()
+    return bodies
+
+
+# Journal of every recipient's status per mailing (job key), so an interrupted job can be
+# resumed without re-sending. Writes are buffered and committed every few rows or seconds;
+# a crash loses at most that last batch, which is then sent again (at-least-once).
+class SendJournal:
+    def __init__(self, path=SEND_JOURNAL_PATH, batch_size=SEND_JOURNAL_BATCH_SIZE,
+                 flush_interval=SEND_JOURNAL_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._connection = None
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS recipients ("
+                "job_key TEXT NOT NULL, address TEXT NOT NULL, status TEXT NOT NULL, detail TEXT, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (job_key, address))"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def record(self, job_key, address, status, detail=""):
+        with self._lock:
+            self._pending.append((job_key, address, status, detail, time.time()))
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO recipients (job_key, address, status, detail, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_key, address) DO UPDATE SET status = excluded.status, "
+                "detail = excluded.detail, updated_at = excluded.updated_at",
+                self._pending
+            )
+        self._pending = []
+
+    def delivered(self, job_key):
+        with self._lock:
+            self._flush()
+            rows = self._connect().execute(
+                "SELECT address FROM recipients WHERE job_key = ? AND status = 'sent'", (job_key,)
+            )
+            return {address for (address,) in rows}
+
+
+send_journal = SendJournal()
+
+
+# Function to Identify a Mailing (same data, filters, content and sender -> same key, so it can be resumed)
+def mailing_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
 
+# Function to Drop Tasks whose Recipient the Journal Already Lists as Delivered
+def skip_delivered(tasks, delivered):
+    if not delivered:
+        return tasks, 0
+    remaining = [task for task in tasks if task[2] not in delivered]
+    return remaining, len(tasks) - len(remaining)
 
-# Callback to Send Emails
 
+# Function to Name the Kind of a Send Failure, so failures can be counted by class
+def error_class(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = sorted({code for code, _ in error.recipients.values()})
+        return f"Recipient refused ({', '.join(map(str, codes))})"
+    code = getattr(error, "smtp_code", None)
+    return f"{type(error).__name__} ({code})" if code else type(error).__name__
+
+
+# Function to Describe a Send Failure in One Line (SMTP replies as "code message")
+def error_detail(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        message = error.smtp_error
+        if isinstance(message, bytes):
+            message = message.decode("utf-8", errors="replace")
+        return f"{error.smtp_code} {message}"
+    return str(error)
+
+
+# Function to Turn a Send Result into a Row of the Send Log
+def result_row(result):
+    recipient, ok, error_type, detail, latency = result
+    return {"recipient": recipient, "status": "sent" if ok else "failed", "error": error_type or "",
+            "detail": detail, "latency_ms": round(latency * 1000) if latency is not None else None}
+
+
+# Background Job (runs a target function off the request thread, with pause/cancel)
+class SendJob:
+    def __init__(self, target, total, journal=None, journal_key=None, skipped=0, duplicates=0, invalid=0):
+        self.id = uuid.uuid4().hex
+        self.target = target
+        self.total = total
+        self.journal = journal
+        self.journal_key = journal_key
+        self.skipped = skipped
+        self.duplicates = duplicates
+        self.invalid = invalid
+        self.state = "queued"
+        self.sent = 0
+        self.failed = 0
+        self.results = []  # (recipient, ok, error class, detail, latency in seconds), in completion order
+        self.failures = Counter()
+        self.latencies = []
+        self.notes = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._cancel = threading.Event()
+
+    def run(self):
+        with self._lock:
+            if self._cancel.is_set():
+                return  # Cancelled while still queued; cancel() already marked it
+            self.state = "running" if self._resume.is_set() else "paused"
+            self.started_at = time.time()
+        try:
+            self.target(self)
+            self.state = "cancelled" if self._cancel.is_set() else "finished"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            if self.journal is not None:
+                self.journal.flush()
+        self.finished_at = time.time()
+
+    # Called by the target between messages: blocks while paused, False once cancelled
+    def checkpoint(self):
+        while not self._resume.wait(0.5):
+            if self._cancel.is_set():
+                break
+        return not self._cancel.is_set()
+
+    def record(self, ok, recipient, address=None, error=None, latency=None):
+        error_type = error_class(error) if error is not None else None
+        detail = error_detail(error) if error is not None else ""
+        stage_items.inc("emails_sent" if ok else "emails_failed")
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+                self.failures[error_type] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+            self.results.append((recipient, ok, error_type, detail, latency))
+        if self.journal is not None and address is not None:
+            self.journal.record(self.journal_key, address, "sent" if ok else "failed", detail)
+
+    # Status line that is not about a single recipient (e.g. a sender account dropping out)
+    def note(self, message):
+        with self._lock:
+            self.notes.append(message)
+
+    # One page of per-recipient results as table rows, and the number of rows matching
+    def results_page(self, start, count, failed_only=False):
+        with self._lock:
+            results = [r for r in self.results if not r[1]] if failed_only else self.results
+            page = results[start:start + count]
+            total = len(results)
+        return [result_row(result) for result in page], total
+
+    def results_snapshot(self):
+        with self._lock:
+            return list(self.results)
+
+    def pause(self):
+        if self.done:
+            return
+        self._resume.clear()
+        if self.state == "running":
+            self.state = "paused"
+
+    def resume(self):
+        self._resume.set()
+        if self.state == "paused":
+            self.state = "running"
+
+    def cancel(self):
+        with self._lock:
+            self._cancel.set()
+            self._resume.set()
+            if self.state == "queued":
+                self.state = "cancelled"
+                self.finished_at = time.time()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self.state in ("finished", "cancelled", "failed")
+
+    def progress(self):
+        with self._lock:
+            processed = self.sent + self.failed
+            failures = dict(self.failures.most_common())
+            latencies = np.array(self.latencies)
+            notes = list(self.notes)
+        latency = None
+        if len(latencies):
+            median, p95 = np.percentile(latencies, [50, 95])
+            latency = {"median": float(median), "p95": float(p95), "max": float(latencies.max())}
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        return {
+            "id": self.id,
+            "state": self.state,
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "remaining": self.total - processed,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "throughput": processed / elapsed if elapsed > 0 else 0.0,
+            "elapsed": elapsed,
+            "error": self.error,
+            "failures": failures,
+            "latency": latency,
+            "notes": notes
+        }
+
+
+# In-process job queue served by a few worker threads
+class JobRunner:
+    def __init__(self, workers=SEND_JOB_WORKERS, retention=SEND_JOB_RETENTION):
+        self.workers = workers
+        self.retention = retention
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            if not self._threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._work, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        self._queue.put(job)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            finally:
+                self._queue.task_done()
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [j.id for j in self._jobs.values() if j.done and now - j.finished_at > self.retention]:
+            del self._jobs[job_id]
+
+
+job_runner = JobRunner()
+
+
+class SenderPoolError(ValueError):
+    pass
+
+
+# One sending account (or SMTP relay) of a send job, with its own rate limiter and daily quota
+class SenderAccount:
+    def __init__(self, email, password, host=SMTP_HOST, port=SMTP_PORT, weight=1.0, rate=None, daily_limit=None):
+        self.email = email
+        self.password = password
+        self.host = host or SMTP_HOST
+        self.port = int(port or SMTP_PORT)
+        self.weight = weight
+        self.limiter = get_rate_limiter(email, rate, daily_limit)
+        self.retired = None  # Reason the account stopped taking work in this job
+
+    def session(self):
+        return SMTPSession(self.email, self.password, self.host, self.port, rate_limiter=self.limiter)
+
+
+# Function to Parse the Sender Pool: the main sender plus one extra account per line, written as
+# "email, app password[, weight[, host[:port][, rate[, daily limit]]]]"; host, port, rate (emails per
+# second) and daily limit default to the main sender's, so a relay and a mailbox can have their own quotas
+def parse_sender_pool(text, sender_email, sender_password, smtp_host, smtp_port, rate=None, daily_limit=None):
+    accounts = [SenderAccount(sender_email, sender_password, smtp_host, smtp_port, 1.0, rate, daily_limit)]
+    seen = {sender_email.strip().lower()}
+    for number, line in enumerate((text or "").splitlines(), start=1):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        fields = [field.strip() for field in line.split(",")]
+        if len(fields) < 2 or len(fields) > 6 or not re.match(EMAIL_PATTERN, fields[0].lower()):
+            raise SenderPoolError(f"Sender pool line {number}: expected "
+                                  f"\"email, app password[, weight[, host[:port][, rate[, daily limit]]]]\"")
+        fields += [""] * (6 - len(fields))
+        host, port = smtp_host, smtp_port
+        try:
+            weight = float(fields[2]) if fields[2] else 1.0
+            if fields[3]:
+                host, _, port_text = fields[3].partition(":")
+                port = int(port_text) if port_text else smtp_port
+            account_rate = float(fields[4]) if fields[4] else rate
+            account_limit = int(fields[5]) if fields[5] else daily_limit
+        except ValueError:
+            raise SenderPoolError(f"Sender pool line {number}: weight, port, rate and daily limit must be numbers")
+        if weight <= 0 or (fields[4] and account_rate <= 0) or (fields[5] and account_limit <= 0):
+            raise SenderPoolError(f"Sender pool line {number}: weight, rate and daily limit must be positive")
+        if fields[0].lower() in seen:
+            raise SenderPoolError(f"Sender pool line {number}: {fields[0]} is listed twice")
+        seen.add(fields[0].lower())
+        accounts.append(SenderAccount(fields[0], fields[1], host, port, weight, account_rate, account_limit))
+    return accounts
+
+
+# Function to Size the Shards: proportional to weight, capped by each account's remaining daily quota.
+# Whatever exceeds the pool's total quota is spread by weight alone (those accounts stop at their limit)
+def shard_sizes(weights, capacities, count):
+    sizes = [0] * len(weights)
+    for caps in (capacities, [count] * len(weights)):
+        left = count - sum(sizes)
+        while left > 0:
+            open_accounts = [i for i in range(len(weights)) if caps[i] > sizes[i]]
+            if not open_accounts:
+                break
+            total_weight = sum(weights[i] for i in open_accounts)
+            shares = {i: min(int(left * weights[i] / total_weight), caps[i] - sizes[i]) for i in open_accounts}
+            if not any(shares.values()):
+                shares[max(open_accounts, key=lambda i: weights[i])] = 1
+            for i, share in shares.items():
+                sizes[i] += share
+            left = count - sum(sizes)
+    return sizes
+
+
+# Work queue of a send job split into one shard per account. Sessions take from their own
+# account's shard first, then steal from the largest other shard, so work left by a retired
+# (throttled, locked out or exhausted) account is finished by the others
+class SenderPool:
+    def __init__(self, accounts, tasks):
+        self.accounts = accounts
+        sizes = shard_sizes([a.weight for a in accounts], [a.limiter.remaining_today() for a in accounts], len(tasks))
+        self._shards = {}
+        start = 0
+        for account, size in zip(accounts, sizes):
+            self._shards[account.email] = deque(tasks[start:start + size])
+            start += size
+        self._in_flight = 0
+        self._changed = threading.Condition()
+
+    # Next task for a session of this account; None once there is nothing left it may send
+    def take(self, account, should_stop=None):
+        with self._changed:
+            while not account.retired and not (should_stop and should_stop()):
+                own = self._shards[account.email]
+                donor = own if own else max(self._shards.values(), key=len)
+                if donor:
+                    self._in_flight += 1
+                    return donor.popleft() if donor is own else donor.pop()
+                if not self._in_flight:
+                    return None
+                self._changed.wait(0.5)  # Tasks in flight elsewhere may still be handed back
+            return None
+
+    def finish(self):
+        with self._changed:
+            self._in_flight -= 1
+            self._changed.notify_all()
+
+    # A task the account could not send goes to the active account with the least work queued
+    def give_back(self, account, task):
+        with self._changed:
+            active = [a for a in self.accounts if not a.retired]
+            target = min(active, key=lambda a: len(self._shards[a.email])) if active else account
+            self._shards[target.email].appendleft(task)
+            self._in_flight -= 1
+            self._changed.notify_all()
+
+    # True if the account was still active. With only_if_others, the last active account is kept
+    def retire(self, account, reason, only_if_others=False):
+        with self._changed:
+            if account.retired:
+                return False
+            if only_if_others and not any(not a.retired for a in self.accounts if a is not account):
+                return False
+            account.retired = reason
+            self._changed.notify_all()
+            return True
+
+    def has_active(self):
+        with self._changed:
+            return any(not a.retired for a in self.accounts)
+
+    def remaining(self):
+        with self._changed:
+            return sum(len(shard) for shard in self._shards.values())
+
+
+# Function to Tell whether a Send Error is about the Account Itself (the task is then re-queued).
+# Returns (reason, throttled) or None for errors about the message or recipient
+def account_failure(error):
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return "authentication failed", False
+    if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code in SMTP_RETRY_CODES:
+        return "throttled by the server", True
+    return None
+
+
+# Function to Note that a Sender Account Stopped Taking Work in a Job
+def note_retired(job, pool, account, reason):
+    outcome = "its share goes to the other accounts" if pool.has_active() else "no other sender account is left"
+    job.note(f"⚠️ Sender {account.email} {reason}, {outcome}")
+
+
+# Function to Send a Batch of Emails inside a Job: tasks are sharded over the sender accounts,
+# each running its own parallel SMTP sessions under its own rate limiter
+def run_send_job(job, tasks, accounts, email_subject, concurrency=SMTP_CONCURRENCY, attachments=None):
+    pool = SenderPool(accounts, tasks)
+    attachments = attachments or JobAttachments()
+    sessions = []
+    for account in accounts:
+        first = account.session()
+        try:
+            first.connect()  # Fail fast on a wrong host or bad credentials
+        except Exception as e:
+            pool.retire(account, f"could not connect to {account.host}:{account.port} ({e})")
+            continue
+        count = max(1, min(int(concurrency or 1), len(tasks)))
+        sessions.extend([(account, first)] + [(account, account.session()) for _ in range(count - 1)])
+    if not sessions:
+        raise RuntimeError("; ".join(f"{a.email} {a.retired}" for a in accounts))
+    for account in accounts:
+        if account.retired:
+            note_retired(job, pool, account, account.retired)
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool_threads:
+        results = [pool_threads.submit(dispatch_messages, job, pool, account, session, email_subject, attachments)
+                   for account, session in sessions]
+        for result in results:
+            result.result()
+
+    if pool.remaining() and not job.cancelled:
+        reasons = "; ".join(f"{a.email} {a.retired}" for a in accounts if a.retired)
+        raise RuntimeError(f"{pool.remaining()} emails were not sent, no sender account left ({reasons})")
+
+
+# Function Run by Each Parallel Sender: takes tasks from the pool and sends them over its own SMTP session
+def dispatch_messages(job, pool, account, session, email_subject, attachments):
+    with session:
+        while job.checkpoint():
+            task = pool.take(account, lambda: job.cancelled)
+            if task is None:
+                return
+            to_email, email_body, address, files = task
+            if not account.limiter.acquire(lambda: job.cancelled):
+                pool.give_back(account, task)
+                reason = f"reached its daily sending limit of {account.limiter.daily_limit}"
+                if not job.cancelled and pool.retire(account, reason):
+                    note_retired(job, pool, account, reason)
+                return
+            started = time.monotonic()
+            try:
+                msg = build_message(account.email, to_email, email_subject, email_body, attachments.parts_for(files))
+                session.send(msg)
+            except Exception as e:
+                failure = account_failure(e)
+                if failure is None:
+                    job.record(False, to_email, address, e, time.monotonic() - started)
+                    pool.finish()
+                    continue
+                reason, throttled = failure
+                pool.give_back(account, task)
+                if pool.retire(account, reason, only_if_others=throttled):
+                    note_retired(job, pool, account, reason)
+                    return
+                if throttled:
+                    # Last account left: keep the task and wait out the limiter's back-off before retrying
+                    account.limiter.throttled()
+                    continue
+                return
+            job.record(True, to_email, address, latency=time.monotonic() - started)
+            pool.finish()
+
+
+# Function to Render Job Progress (aggregates only; per-recipient results are in the send log table)
+def render_job_progress(progress):
+    summary = (f"{progress['state'].capitalize()}: {progress['sent']:,} sent, {progress['failed']:,} failed, "
+               f"{progress['remaining']:,} remaining ({progress['throughput']:.1f} emails/s, "
+               f"{progress['elapsed']:.0f} s elapsed)")
+    children = [html.P(summary)]
+    if progress["latency"]:
+        latency = progress["latency"]
+        children.append(html.P(f"Latency: median {latency['median'] * 1000:.0f} ms, "
+                               f"p95 {latency['p95'] * 1000:.0f} ms, max {latency['max'] * 1000:.0f} ms",
+                               style={"color": "#333", "fontWeight": "normal"}))
+    if progress["skipped"] or progress["duplicates"] or progress["invalid"]:
+        children.append(html.P(f"Skipped {progress['skipped']} already sent, {progress['duplicates']} duplicate "
+                               f"and {progress['invalid']} empty or invalid recipients"))
+    if progress["failures"]:
+        children.append(html.Div([
+            html.P("Failures by error", style={"color": "#dc3545", "marginBottom": "2px"}),
+            html.Ul([html.Li(f"{error}: {count:,}") for error, count in progress["failures"].items()],
+                    style={"listStyle": "none", "padding": 0, "color": "#dc3545", "fontWeight": "normal"})
+        ]))
+    if progress["error"]:
+        children.append(html.P(f"❌ {progress['error']}", style={"color": "#dc3545"}))
+    return html.Div(children)
+
+
+# Streams the per-recipient results of a send job as CSV
+@app.server.route("/send-log/<job_id>.csv")
+def download_send_log(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return flask.jsonify(error="Unknown send job"), 404
+    columns = ["recipient", "status", "error", "detail", "latency_ms"]
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns)
+        writer.writeheader()
+        for start, result in enumerate(job.results_snapshot()):
+            writer.writerow(result_row(result))
+            if start % 1000 == 999:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return flask.Response(generate(), mimetype="text/csv",
+                          headers={"Content-Disposition": f"attachment; filename=send_log_{job_id}.csv"})
+
+
+# Callback to Add Uploaded Attachments (sent by assets/chunked_upload.js) or Clear them
+@app.callback(
+    [Output("attachments", "data"), Output("attachment-list", "children")],
+    [Input("attachment-upload", "data"), Input("clear-attachments", "n_clicks")],
+    State("attachments", "data"),
+    prevent_initial_call=True
+)
+def update_attachments(uploaded, clear_clicks, attachments):
+    attachments = [] if ctx.triggered_id == "clear-attachments" else [dict(a) for a in attachments or []]
+    if ctx.triggered_id == "attachment-upload" and uploaded:
+        known = {(a["kind"], a["filename"]): a for a in attachments}
+        for upload in uploaded["files"]:
+            attachment = {"id": check_dataset_id(upload["dataset_id"]),
+                          "filename": os.path.basename(upload["filename"]), "kind": uploaded["kind"]}
+            key = (attachment["kind"], attachment["filename"])
+            if key in known:
+                known[key]["id"] = attachment["id"]  # A re-upload under the same name replaces the file
+            else:
+                known[key] = attachment
+                attachments.append(attachment)
+    labels = {"shared": "📎 Shared", "row": "📄 Per-row"}
+    return attachments, [html.Div(f"{labels[a['kind']]}: {a['filename']}") for a in attachments]
+
+
+# Callback to Check Recipients before Sending (summary per column plus the problem rows)
+@app.callback(
+    Output("recipient-check", "children"),
+    Input("check-recipients", "n_clicks"),
+    [State("dataset-id", "data"), State("filtered-result", "data"),
+     State("filtered-table", "filter_query"), State("filtered-table", "sort_by"),
+     State("name-column-1", "value"), State("email-column-1", "value"),
+     State("name-column-2", "value"), State("email-column-2", "value")],
+    prevent_initial_call=True
+)
+def check_recipients_summary(n_clicks, dataset_id, result, filter_query, sort_by,
+                             name_col_1, email_col_1, name_col_2, email_col_2):
+    if not dataset_id or not result:
+        return "⏳ Apply filters to check recipients."
+
+    df = get_table_view(dataset_id, result["filters"], filter_query, sort_by)
+    recipients = check_recipients(df, [(name_col_1, email_col_1), (name_col_2, email_col_2)])
+    if recipients.empty:
+        return "No recipients: select the name and email columns first."
+
+    summary = summarize_recipients(recipients)
+    problems = recipients[recipients["issue"].notna()].head(RECIPIENT_ISSUES_SHOWN)
+    problems = problems.assign(row=problems["row"] + 1)[["row", "column", "address", "issue"]]
+    table_style = {"style_table": {"overflowX": "auto", "margin": "auto"},
+                   "style_header": {"backgroundColor": "#007BFF", "color": "white", "fontWeight": "bold"},
+                   "style_cell": {"textAlign": "center", "padding": "6px"}}
+    children = [
+        html.P(f"{int(recipients['issue'].isna().sum()):,} of {len(recipients):,} recipients will be emailed"),
+        dash_table.DataTable(columns=[{"name": c, "id": c} for c in summary.columns],
+                             data=summary.to_dict("records"), **table_style)
+    ]
+    if not problems.empty:
+        children.append(html.P("Skipped recipients", className="mt-3"))
+        children.append(dash_table.DataTable(
+            columns=[{"name": c.capitalize(), "id": c} for c in problems.columns],
+            data=problems.to_dict("records"), page_size=10, **table_style
+        ))
+    return html.Div(children)
+
+
+# Callback to Preview the First Rendered Emails
+@app.callback(
+    [Output("template-preview", "children"), Output("template-error", "children")],
+    Input("preview-email", "n_clicks"),
+    [State("sender-name", "value"), State("company-name", "value"), State("email-template", "value"),
+     State("dataset-id", "data"), State("filtered-result", "data"),
+     State("filtered-table", "filter_query"), State("filtered-table", "sort_by"),
+     State("name-column-1", "value"), State("email-column-1", "value"),
+     State("name-column-2", "value"), State("email-column-2", "value")],
+    prevent_initial_call=True
+)
+def preview_emails(n_clicks, sender_name, company_name, email_template, dataset_id, result, filter_query, sort_by,
+                   name_col_1, email_col_1, name_col_2, email_col_2):
+    if not dataset_id or not result:
+        return "⏳ Apply filters to preview emails.", ""
+
+    df = get_table_view(dataset_id, result["filters"], filter_query, sort_by)
+    try:
+        tasks, _ = build_send_tasks(df.head(TEMPLATE_PREVIEW_ROWS), email_template,
+                                    [(name_col_1, email_col_1), (name_col_2, email_col_2)], company_name, sender_name)
+    except TemplateError as e:
+        return "", f"❌ {e}"
+    if not tasks:
+        return "No recipients: select the name and email columns first.", ""
+    return [html.Div([html.Strong(f"To: {to_email}"), html.Pre(body, style={"whiteSpace": "pre-wrap"})],
+                     style={"borderBottom": "1px solid #ddd", "padding": "8px"})
+            for to_email, body, _, _ in tasks], ""
+
+
+# Callback to Send Emails (starts a background job and returns its ID right away)
 @app.callback(
-    Output("email-status", "children"),
+    [Output("send-job-id", "data"), Output("send-job-poll", "disabled"),
+     Output("template-error", "children", allow_duplicate=True)],
     Input("send-email", "n_clicks"),
     [State("sender-name", "value"), State("sender-email", "value"), State("sender-password", "value"),
      State("company-name", "value"), State("email-subject", "value"), State("email-template", "value"),
-     State("filtered-table", "data"),  # ✅ Correct - Use filtered-table data
+     State("dataset-id", "data"), State("filtered-result", "data"),  # ✅ Server-side filtered result
+     State("filtered-table", "filter_query"), State("filtered-table", "sort_by"),
      State("name-column-1", "value"), State("email-column-1", "value"),
-     State("name-column-2", "value"), State("email-column-2", "value")]
+     State("name-column-2", "value"), State("email-column-2", "value"),
+     State("smtp-host", "value"), State("smtp-port", "value"),
+     State("smtp-concurrency", "value"), State("sender-rate", "value"), State("sender-daily-limit", "value"),
+     State("resume-send", "value"), State("attachments", "data"), State("attachment-column", "value"),
+     State("sender-pool", "value")],
+    prevent_initial_call=True
 )
 
 def send_emails(n_clicks, sender_name, sender_email, sender_password, company_name, email_subject, email_template, 
-                 filtered_data, name_col_1, email_col_1, name_col_2, email_col_2):
-    if not n_clicks or not filtered_data:
-        return "⏳ Apply filters and click 'Send Emails' to start."
-    
-    df = pd.DataFrame(filtered_data)
-    status_messages = []
-    
-    for _, row in df.iterrows():
-        # Name 1 → Email 1
-        if name_col_1 and email_col_1 and row.get(email_col_1):
-            email_body = email_template.format(
-                employee_name=row.get(name_col_1, "Employee"),
-                company_name=company_name,
-                designation=row.get("Designation", ""),
-                sender_name=sender_name
-            )
-            status_messages.append(send_email(sender_email, sender_password, row[email_col_1], email_subject, email_body))
-        
-        # Name 2 → Email 2
-        if name_col_2 and email_col_2 and row.get(email_col_2):
-            email_body = email_template.format(
-                employee_name=row.get(name_col_2, "Employee"),
-                company_name=company_name,
-                designation=row.get("Designation", ""),
-                sender_name=sender_name
-            )
-            status_messages.append(send_email(sender_email, sender_password, row[email_col_2], email_subject, email_body))
-    
-    return html.Div([html.P(status) for status in status_messages])
+                 dataset_id, result, filter_query, sort_by, name_col_1, email_col_1, name_col_2, email_col_2,
+                 smtp_host, smtp_port, concurrency, rate, daily_limit, resume, attachments, attachment_column,
+                 sender_pool):
+    if not n_clicks or not dataset_id or not result:
+        return dash.no_update, dash.no_update, dash.no_update
+
+    df = get_table_view(dataset_id, result["filters"], filter_query, sort_by)
+    if df.empty:
+        return dash.no_update, dash.no_update, dash.no_update
+
+    # Template and attachments are checked before anything is sent; shared files are encoded once here
+    shared_files = [a for a in attachments or [] if a["kind"] == "shared"]
+    per_row_files = [a for a in attachments or [] if a["kind"] == "row"]
+    try:
+        tasks, recipients = build_send_tasks(df, email_template, [(name_col_1, email_col_1), (name_col_2, email_col_2)],
+                                             company_name, sender_name, attachment_column,
+                                             [a["filename"] for a in per_row_files])
+        job_attachments = JobAttachments(shared_files, per_row_files)
+        accounts = parse_sender_pool(sender_pool, sender_email or "", sender_password, smtp_host, smtp_port,
+                                     rate, daily_limit)
+    except (TemplateError, AttachmentError, SenderPoolError) as e:
+        return dash.no_update, dash.no_update, f"❌ {e}"
+
+    # Each valid recipient is mailed once; on resume, those the journal already lists as sent are skipped
+    journal_key = mailing_key(dataset_id, result["filters"], filter_query, email_subject, email_template,
+                              [name_col_1, email_col_1, name_col_2, email_col_2], sender_email,
+                              attachments, attachment_column)
+    tasks, skipped = skip_delivered(tasks, send_journal.delivered(journal_key) if resume else set())
+    duplicates = int((recipients["issue"] == "duplicate").sum())
+    invalid = int(recipients["issue"].isin(["empty", "malformed"]).sum())
+
+    job = SendJob(
+        lambda job: run_send_job(job, tasks, accounts, email_subject, concurrency, job_attachments),
+        len(tasks), send_journal, journal_key, skipped, duplicates, invalid
+    )
+    return job_runner.submit(job), False, ""
+
+
+# Callback to Poll Send Progress and Handle Pause / Resume / Cancel.
+# The summary is a handful of nodes; notes are appended as a Patch, so each poll only sends what is new
+@app.callback(
+    [Output("email-status", "children"), Output("send-notes", "children"), Output("send-status-seen", "data"),
+     Output("send-job-poll", "disabled", allow_duplicate=True), Output("send-log-link", "href")],
+    [Input("send-job-poll", "n_intervals"), Input("send-job-id", "data"),
+     Input("pause-send-job", "n_clicks"), Input("resume-send-job", "n_clicks"), Input("cancel-send-job", "n_clicks")],
+    State("send-status-seen", "data"),
+    prevent_initial_call="initial_duplicate"
+)
+def poll_send_job(n_intervals, job_id, pause_clicks, resume_clicks, cancel_clicks, seen):
+    job = job_runner.get(job_id) if job_id else None
+    if job is None:
+        return "⏳ Apply filters and click 'Send Emails' to start.", [], None, True, None
+
+    if ctx.triggered_id == "pause-send-job":
+        job.pause()
+    elif ctx.triggered_id == "resume-send-job":
+        job.resume()
+    elif ctx.triggered_id == "cancel-send-job":
+        job.cancel()
+
+    progress = job.progress()
+    shown = seen["notes"] if seen and seen.get("job") == job.id else None
+    if shown is None:
+        notes = [html.P(note) for note in progress["notes"]]
+    elif shown < len(progress["notes"]):
+        notes = dash.Patch()
+        notes.extend([html.P(note) for note in progress["notes"][shown:]])
+    else:
+        notes = dash.no_update
+    return (render_job_progress(progress), notes, {"job": job.id, "notes": len(progress["notes"])}, job.done,
+            app.get_relative_path(f"/send-log/{job.id}.csv"))
+
+
+# Callback to Page through the Per-recipient Send Log
+@app.callback(
+    [Output("send-log-table", "data"), Output("send-log-table", "page_count")],
+    [Input("send-log-table", "page_current"), Input("send-log-table", "page_size"), Input("send-log-filter", "value"),
+     Input("send-job-poll", "n_intervals"), Input("send-job-id", "data")]
+)
+def update_send_log(page_current, page_size, log_filter, n_intervals, job_id):
+    job = job_runner.get(job_id) if job_id else None
+    if job is None:
+        return [], 0
+    page_size = page_size or 10
+    rows, total = job.results_page((page_current or 0) * page_size, page_size, log_filter == "failed")
+    return rows, max(1, -(-total // page_size))
 
 
 # Run App
@@ -0,0 +1,133 @@
+// Chunked, resumable upload of the dataset file and attachments to the /upload routes in app.py.
+// Files never go through a Dash callback: once stored, only their IDs are handed to Dash
+// (dataset-id store for the dataset, attachment-upload store for attachments).
+(function () {
+    var CHUNK_BYTES = 4 * 1024 * 1024;
+    var MAX_RETRIES = 5;
+
+    function setProps(id, props) {
+        if (window.dash_clientside && window.dash_clientside.set_props) {
+            window.dash_clientside.set_props(id, props);
+        }
+    }
+
+    function showStatus(text) {
+        setProps("upload-status", {children: text});
+    }
+
+    function baseUrl() {
+        var config = document.getElementById("_dash-config");
+        var prefix = config ? JSON.parse(config.textContent).requests_pathname_prefix : "/";
+        return (prefix || "/") + "upload/";
+    }
+
+    // Same file (name, size, modification time) -> same upload ID, so an interrupted upload resumes
+    function uploadId(file) {
+        var key = [file.name, file.size, file.lastModified].join(":");
+        var h1 = 0x811c9dc5, h2 = 0x01000193;
+        for (var i = 0; i < key.length; i++) {
+            h1 = Math.imul(h1 ^ key.charCodeAt(i), 0x01000193) >>> 0;
+            h2 = Math.imul(h2 ^ key.charCodeAt(i), 0x811c9dc5) >>> 0;
+        }
+        return "u" + h1.toString(16) + h2.toString(16) + file.size.toString(16);
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    // 409 answers carry the number of bytes the server really has, so they are not errors here
+    async function request(method, url, body, contentType) {
+        for (var attempt = 0; ; attempt++) {
+            try {
+                var options = {method: method, body: body};
+                if (contentType) {
+                    options.headers = {"Content-Type": contentType};
+                }
+                var response = await fetch(url, options);
+                var payload = await response.json();
+                if (response.ok || response.status === 409) {
+                    return payload;
+                }
+                if (response.status < 500 || attempt >= MAX_RETRIES) {
+                    throw new Error(payload.error || response.statusText);
+                }
+            } catch (error) {
+                if (attempt >= MAX_RETRIES) {
+                    throw error;
+                }
+            }
+            await sleep(500 * Math.pow(2, attempt));
+        }
+    }
+
+    // Stores one file; kind "dataset" also makes the server start parsing it
+    async function upload(file, kind) {
+        var url = baseUrl() + uploadId(file);
+        var status = await request("GET", url);
+        var offset = Math.min(status.received || 0, file.size);
+        showStatus("⏳ Uploading " + file.name + "...");
+        while (offset < file.size) {
+            var result = await request("POST", url + "?offset=" + offset, file.slice(offset, offset + CHUNK_BYTES),
+                                       "application/octet-stream");
+            offset = result.received;
+            showStatus("⏳ Uploading " + file.name + "... " + Math.floor(100 * offset / file.size) + "%");
+        }
+        var done = await request("POST", url + "/complete",
+                                 JSON.stringify({filename: file.name, size: file.size, kind: kind}),
+                                 "application/json");
+        if (!done.dataset_id) {
+            throw new Error(done.error || "upload was not completed");
+        }
+        return done.dataset_id;
+    }
+
+    async function uploadDataset(file) {
+        var datasetId = await upload(file, "dataset");
+        setProps("dataset-filename", {data: file.name});
+        setProps("dataset-id", {data: datasetId});
+    }
+
+    // Attachments are uploaded one after another and handed to Dash as a single batch
+    async function uploadAttachments(files, kind) {
+        var uploaded = [];
+        for (var i = 0; i < files.length; i++) {
+            uploaded.push({filename: files[i].name, dataset_id: await upload(files[i], kind)});
+        }
+        showStatus("✅ Uploaded " + uploaded.length + " attachment(s)");
+        setProps("attachment-upload", {data: {files: uploaded, kind: kind, nonce: Date.now()}});
+    }
+
+    // Button id -> what its file picker uploads
+    var PICKERS = {
+        "upload-file-btn": {accept: ".xlsx,.xlsm,.xls,.csv,.tsv,.txt", multiple: false, kind: "dataset"},
+        "upload-shared-attachment-btn": {accept: "", multiple: true, kind: "shared"},
+        "upload-row-attachment-btn": {accept: "", multiple: true, kind: "row"}
+    };
+
+    // The upload buttons open a plain file picker (dcc.Upload would base64-encode the file in the browser)
+    document.addEventListener("click", function (event) {
+        var button = event.target && event.target.closest
+            ? event.target.closest(Object.keys(PICKERS).map(function (id) { return "#" + id; }).join(","))
+            : null;
+        if (!button) {
+            return;
+        }
+        var picker = PICKERS[button.id];
+        var input = document.createElement("input");
+        input.type = "file";
+        input.accept = picker.accept;
+        input.multiple = picker.multiple;
+        input.addEventListener("change", function () {
+            if (!input.files.length) {
+                return;
+            }
+            var files = Array.prototype.slice.call(input.files);
+            var pending = picker.kind === "dataset" ? uploadDataset(files[0]) : uploadAttachments(files, picker.kind);
+            pending.catch(function (error) {
+                showStatus("❌ Upload failed: " + error.message);
+            });
+        });
+        input.click();
+    });
+})();
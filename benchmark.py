@@ -0,0 +1,489 @@
+"""Benchmarks for app.py: parse, filter, export and send paths on synthetic workbooks.
+
+Runs headlessly: callbacks are invoked through the Flask test client (the same JSON the
+browser sends), and emails go to an in-process SMTP sink that can add latency and throttle.
+
+    python benchmark.py                          # 1k, 10k and 100k rows
+    python benchmark.py --rows 1000000 --repeat 1
+    python benchmark.py --save-baseline          # record the current numbers
+    python benchmark.py --smtp-latency 50 --throttle-every 200
+
+Results are compared with the baseline file (benchmark_baseline.json); a benchmark whose median
+time or peak memory grew by more than --tolerance is flagged and the exit status is 1.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+# app.py reads its settings at import time, so the benchmark's working directories go first
+WORK_DIR = tempfile.mkdtemp(prefix="email-automation-bench-")
+os.environ.update({
+    "UPLOAD_DIR": os.path.join(WORK_DIR, "uploads"),
+    "EXPORT_DIR": os.path.join(WORK_DIR, "exports"),
+    "DATASET_SPILL_DIR": os.path.join(WORK_DIR, "spill"),
+    "SEND_JOURNAL_PATH": os.path.join(WORK_DIR, "journal.sqlite3"),
+    "SMTP_USE_TLS": "0",
+    "SENDER_MAX_BACKOFF": os.environ.get("SENDER_MAX_BACKOFF", "1"),
+})
+
+import app  # noqa: E402
+
+DEFAULT_ROWS = "1000,10000,100000"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+FILTER_COLUMNS = ["Department", "City", "Manager", "Employee ID"]  # Low to unique cardinality
+MEMORY_NOISE_MB = 8
+
+
+# Function to Build a Synthetic Employee Sheet (columns from a dozen distinct values up to unique)
+def synthetic_frame(rows, seed=42):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(rows)
+    departments = np.array(["Sales", "Finance", "HR", "IT", "Legal", "Marketing", "Operations", "Support",
+                            "Research", "Logistics", "Procurement", "Design"])
+    return pd.DataFrame({
+        "Employee ID": ids,
+        "Name": [f"Employee {i}" for i in ids],
+        "Email": [f"employee{i}@example.com" for i in ids],
+        "Department": departments[rng.integers(0, len(departments), rows)],
+        "City": [f"City {i}" for i in rng.integers(0, min(1000, rows), rows)],
+        "Manager": [f"Manager {i}" for i in rng.integers(0, max(rows // 50, 1), rows)],
+        "Salary": rng.integers(30000, 200000, rows),
+        "Joined": pd.Timestamp("2010-01-01") + pd.to_timedelta(rng.integers(0, 5000, rows), unit="D"),
+    })
+
+
+# Function to Write (once) the Synthetic Workbook or CSV for a Row Count; files are reused across runs
+def synthetic_file(rows, fmt, data_dir):
+    path = os.path.join(data_dir, f"synthetic_{rows}.{fmt}")
+    if os.path.exists(path):
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    df = synthetic_frame(rows)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    if fmt == "csv":
+        df.to_csv(tmp_path, index=False)
+    else:
+        # Row by row in constant_memory mode, so even 1M rows are written in bounded memory
+        with xlsxwriter.Workbook(tmp_path, {"constant_memory": True}) as workbook:
+            sheet = workbook.add_worksheet("Employees")
+            date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+            sheet.write_row(0, 0, list(df.columns))
+            for row, values in enumerate(df.itertuples(index=False, name=None), start=1):
+                sheet.write_row(row, 0, values[:7])
+                sheet.write_datetime(row, 7, values[7].to_pydatetime(), date_format)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Function to Store a File as an Upload (what /upload/<id>/complete does) and Return its Dataset ID
+def store_upload(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    dataset_id = digest.hexdigest()
+    os.makedirs(app.UPLOAD_DIR, exist_ok=True)
+    shutil.copyfile(path, app.upload_path(dataset_id))
+    return dataset_id
+
+
+# Resident memory of this process, sampled in the background while a benchmark runs
+class MemorySampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def rss():
+        try:
+            with open("/proc/self/statm") as handle:
+                return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def __enter__(self):
+        gc.collect()
+        self.start_bytes = self.peak_bytes = self.rss() or 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.rss() or 0)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, self.rss() or 0)
+
+    @property
+    def peak_mb(self):
+        return None if self.rss() is None else (self.peak_bytes - self.start_bytes) / 2 ** 20
+
+
+# Minimal SMTP server for the send benchmarks: accepts everything, optionally after a delay,
+# and answers "421 try again later" to every Nth message to exercise the back-off path
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, throttle_every=0):
+        super().__init__(("127.0.0.1", 0), SMTPSinkHandler)
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.received = 0
+        self.throttled = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    # Reply to the end of a message's DATA
+    def accept_message(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            seen = self.received + self.throttled + 1
+            if self.throttle_every and seen % self.throttle_every == 0:
+                self.throttled += 1
+                return b"421 4.7.0 Try again later\r\n"
+            self.received += 1
+        return b"250 2.0.0 Queued\r\n"
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        with self.server._lock:
+            self.server.connections += 1
+        self.wfile.write(b"220 benchmark-sink ESMTP\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line[:4].upper()
+            if verb == b"EHLO":
+                self.wfile.write(b"250-benchmark-sink\r\n250 8BITMIME\r\n")
+            elif verb == b"DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                for data_line in iter(self.rfile.readline, b""):
+                    if data_line == b".\r\n":
+                        break
+                self.wfile.write(self.server.accept_message())
+            elif verb == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            elif verb in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                self.wfile.write(b"250 OK\r\n")
+            else:
+                self.wfile.write(b"502 Command not implemented\r\n")
+
+
+# Calls Dash callbacks through the Flask test client, building the request from the callback's
+# dependency entry. Values are keyed "component-id.property"; pattern-matching (ALL) ids are keyed
+# "type.property" with one value per index
+class DashClient:
+    def __init__(self, dash_app):
+        self.client = dash_app.server.test_client()
+        dependencies = self.client.get("/_dash-dependencies").get_json()
+        self.dependencies = {dependency["output"]: dependency for dependency in dependencies}
+
+    # The callback writing `output` ("component-id.property"; pattern ids as their JSON string)
+    def find(self, output):
+        for key, dependency in self.dependencies.items():
+            if output in (key.strip(".").split("...") if key.startswith("..") else [key]):
+                return dependency
+        raise KeyError(f"No callback writes {output}")
+
+    @staticmethod
+    def _expand(spec, values, indices, with_value=True):
+        prop = spec["property"]
+        if spec["id"].startswith("{"):
+            kind = json.loads(spec["id"])["type"]
+            given = values.get(f"{kind}.{prop}", [None] * len(indices))
+            items = [{"id": {"index": i, "type": kind}, "property": prop} for i in indices]
+            if with_value:
+                for item, value in zip(items, given):
+                    item["value"] = value
+            return items
+        item = {"id": spec["id"], "property": prop}
+        if with_value:
+            item["value"] = values.get(f"{spec['id']}.{prop}")
+        return item
+
+    # Returns {component id: {property: value}} and the response size in bytes
+    def call(self, output, values, triggered, indices=(0,)):
+        dependency = self.find(output)
+        output_key = dependency["output"]
+        specs = [part.rsplit(".", 1) for part in output_key.strip(".").split("...")] \
+            if output_key.startswith("..") else [output_key.rsplit(".", 1)]
+        outputs = [self._expand({"id": component, "property": prop.split("@")[0]}, values, indices, False)
+                   for component, prop in specs]
+        body = {
+            "output": output_key,
+            "outputs": outputs if output_key.startswith("..") else outputs[0],
+            "inputs": [self._expand(spec, values, indices) for spec in dependency["inputs"]],
+            "state": [self._expand(spec, values, indices) for spec in dependency["state"]],
+            "changedPropIds": [triggered],
+        }
+        response = self.client.post("/_dash-update-component", json=body)
+        if response.status_code == 204:
+            return {}, 0
+        if response.status_code != 200:
+            raise RuntimeError(f"Callback {output} failed with HTTP {response.status_code}")
+        return response.get_json().get("response", {}), len(response.data)
+
+
+# Function to Clear the In-memory Caches so each repetition measures the cold path
+def clear_caches(keep_dataset=True):
+    for cache in (app.result_cache, app.index_cache, app.filter_cache):
+        cache.clear()
+    if not keep_dataset:
+        app.dataset_cache.clear()
+
+
+# Function to Time a Benchmark: run it `repeat` times (setup not timed), keep durations and peak memory
+def measure(name, rows, repeat, run, setup=None, items=None):
+    durations = []
+    peak_mb = None
+    extra = {}
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with MemorySampler() as memory:
+            started = time.perf_counter()
+            extra = run() or {}
+            durations.append(time.perf_counter() - started)
+        if memory.peak_mb is not None:
+            peak_mb = max(peak_mb or 0.0, memory.peak_mb)
+    median = float(np.median(durations))
+    count = items if items is not None else rows
+    result = {
+        "name": name,
+        "rows": rows,
+        "repeat": repeat,
+        "median_s": median,
+        "p95_s": float(np.percentile(durations, 95)),
+        "throughput": count / median if median > 0 else None,
+        "peak_mb": peak_mb,
+    }
+    result.update(extra)
+    return result
+
+
+# Function to Run the Benchmarks for One Row Count
+def run_suite(rows, args, client, sink):
+    results = []
+    dataset_ids = {}
+    for fmt in args.formats:
+        path = synthetic_file(rows, fmt, args.data_dir)
+        dataset_id = dataset_ids[fmt] = store_upload(path)
+        def parse(dataset_id=dataset_id):
+            return {"columns": len(app.parse_contents(dataset_id).columns)}
+        results.append(measure(f"parse_contents[{fmt}]", rows, args.repeat, parse))
+
+    dataset_id = dataset_ids[args.formats[0]]
+    app.load_dataset(dataset_id)
+
+    # Filter value options, one column per cardinality (index built cold each time)
+    for column in FILTER_COLUMNS:
+        def filter_values(column=column):
+            response, size = client.call('{"index":["ALL"],"type":"filter-value"}.options', {"filter-column.value": [column], "dataset-id.data": dataset_id},
+                                         '{"index":0,"type":"filter-column"}.value')
+            return {"response_bytes": size}
+        results.append(measure(f"update_filter_values[{column}]", rows, args.repeat, filter_values, clear_caches))
+
+    # Apply two filters (low-cardinality "in" plus a numeric range)
+    filter_inputs = {
+        "dataset-id.data": dataset_id,
+        "filter-column.value": ["Department", "Salary"],
+        "filter-operation.value": ["in", "range"],
+        "filter-value.value": [["Sales", "IT", "HR"], None],
+        "filter-min.value": [None, 50000],
+        "filter-max.value": [None, 150000],
+        "filter-text.value": [None, None],
+    }
+
+    def apply_filters():
+        response, size = client.call("filtered-result.data", filter_inputs, "apply-filters-btn.n_clicks", (0, 1))
+        if "filtered-result" not in response:
+            raise RuntimeError("apply_filters returned no result")
+        return {"response_bytes": size}
+    results.append(measure("apply_filters", rows, args.repeat, apply_filters, clear_caches))
+
+    # Export the filtered result in every format (files are removed so each run writes them again)
+    result = {"filters": app.build_predicates(
+        filter_inputs["filter-column.value"], filter_inputs["filter-operation.value"],
+        filter_inputs["filter-value.value"], filter_inputs["filter-min.value"], filter_inputs["filter-max.value"],
+        filter_inputs["filter-text.value"])}
+    exported = len(app.get_filtered_result(dataset_id, result["filters"]))
+    for fmt in args.export_formats:
+        def export(fmt=fmt):
+            response, _ = client.call("export-url.data", {
+                "download-btn.n_clicks": 1, "dataset-id.data": dataset_id, "filtered-result.data": result,
+                "filtered-table.filter_query": "", "filtered-table.sort_by": [], "download-format.value": fmt
+            }, "download-btn.n_clicks")
+            url = response["export-url"]["data"]
+            download = client.client.get(url.split("?")[0])
+            return {"export_bytes": len(download.data)}
+        results.append(measure(f"download_filtered_data[{fmt}]", exported, args.repeat, export,
+                               lambda: shutil.rmtree(app.EXPORT_DIR, ignore_errors=True)))
+
+    # Send to the first N rows through the SMTP sink (the range filter on Employee ID picks them)
+    messages = min(args.messages, rows)
+    if messages:
+        results.append(measure("send_emails", rows, 1, lambda: send_emails(client, sink, dataset_id, messages, args),
+                               items=messages))
+    return results
+
+
+# Function to Start a Send Job through the send_emails Callback and Wait for it to Finish
+def send_emails(client, sink, dataset_id, messages, args):
+    sender = f"bench-{uuid.uuid4().hex[:8]}@example.com"  # Fresh rate limiter and journal key per run
+    result = {"filters": [{"column": "Employee ID", "op": "range", "min": 0, "max": messages - 1}]}
+    response, _ = client.call("send-job-id.data", {
+        "send-email.n_clicks": 1, "sender-name.value": "Benchmark", "sender-email.value": sender,
+        "sender-password.value": "", "company-name.value": "Example Inc", "email-subject.value": "Benchmark",
+        "email-template.value": "Dear {employee_name},\n\nThis is a benchmark from {company_name}.\n\n{sender_name}",
+        "dataset-id.data": dataset_id, "filtered-result.data": result, "filtered-table.filter_query": "",
+        "filtered-table.sort_by": [], "name-column-1.value": "Name", "email-column-1.value": "Email",
+        "smtp-host.value": "127.0.0.1", "smtp-port.value": sink.port, "smtp-concurrency.value": args.concurrency,
+        "sender-rate.value": args.send_rate, "sender-daily-limit.value": 10 ** 9, "resume-send.value": [],
+        "attachments.data": [], "sender-pool.value": ""
+    }, "send-email.n_clicks")
+    job_id = response.get("send-job-id", {}).get("data")
+    if not job_id:
+        raise RuntimeError(f"send_emails did not start a job: {response}")
+    job = app.job_runner.get(job_id)
+    while not job.done:
+        time.sleep(0.01)
+    progress = job.progress()
+    if job.error or progress["sent"] != messages:
+        raise RuntimeError(f"Send job {progress['state']}: {progress['sent']} of {messages} sent ({job.error})")
+    latencies = np.array(job.latencies)
+    return {
+        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "latency_p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+# Function to Compare Results with the Baseline; returns the names of regressed benchmarks
+def compare(results, baseline, tolerance):
+    regressions = []
+    for result in results:
+        key = f"{result['name']}@{result['rows']}"
+        previous = baseline.get(key)
+        result["baseline_s"] = previous and previous.get("median_s")
+        if not previous:
+            continue
+        slower = result["median_s"] > previous["median_s"] * (1 + tolerance)
+        # Memory deltas of a few MB are sampling noise, hence the fixed allowance
+        bigger = (result["peak_mb"] is not None and previous.get("peak_mb") is not None
+                  and result["peak_mb"] > previous["peak_mb"] * (1 + tolerance) + MEMORY_NOISE_MB)
+        if slower or bigger:
+            result["regression"] = "time" if slower else "memory"
+            regressions.append(key)
+    return regressions
+
+
+# Function to Format the Report Table
+def format_report(results, regressions, tolerance):
+    lines = [f"{'benchmark':<40}{'rows':>9}{'median s':>11}{'p95 s':>10}{'items/s':>12}{'peak MB':>9}"
+             f"{'p50/p95/p99 ms':>18}{'baseline s':>12}  flag"]
+    for result in results:
+        latency = (f"{result['latency_p50_ms']:.1f}/{result['latency_p95_ms']:.1f}/{result['latency_p99_ms']:.1f}"
+                   if "latency_p50_ms" in result else "")
+        lines.append(
+            f"{result['name']:<40}{result['rows']:>9,}{result['median_s']:>11.4f}{result['p95_s']:>10.4f}"
+            f"{(result['throughput'] or 0):>12,.0f}"
+            f"{(format(result['peak_mb'], '.1f') if result['peak_mb'] is not None else 'n/a'):>9}"
+            f"{latency:>18}"
+            f"{(format(result['baseline_s'], '.4f') if result.get('baseline_s') else '-'):>12}"
+            f"  {('REGRESSION (' + result['regression'] + ')') if result.get('regression') else ''}"
+        )
+    if regressions:
+        lines.append(f"\n{len(regressions)} benchmark(s) regressed by more than {tolerance:.0%}: {', '.join(regressions)}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the parse, filter, export and send paths of app.py")
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help=f"comma-separated row counts (default {DEFAULT_ROWS})")
+    parser.add_argument("--formats", default="xlsx,csv", help="input file formats to parse (xlsx, csv)")
+    parser.add_argument("--export-formats", default="xlsx,csv,parquet" if app.feather is not None else "xlsx,csv")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per benchmark (median and p95 are reported)")
+    parser.add_argument("--messages", type=int, default=1000, help="emails sent per row count (0 to skip sending)")
+    parser.add_argument("--concurrency", type=int, default=4, help="SMTP connections used by the send benchmark")
+    parser.add_argument("--send-rate", type=float, default=10000, help="emails per second allowed by the rate limiter")
+    parser.add_argument("--smtp-latency", type=float, default=0, help="milliseconds the sink waits before accepting")
+    parser.add_argument("--throttle-every", type=int, default=0, help="the sink answers 421 to every Nth message")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "email-automation-bench-data"),
+                        help="where synthetic files are generated (and reused)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown / memory growth (0.25 = 25%%)")
+    parser.add_argument("--output", help="also write the report to this file (e.g. bench_output.txt)")
+    args = parser.parse_args(argv)
+    args.formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    args.export_formats = [fmt.strip() for fmt in args.export_formats.split(",") if fmt.strip()]
+
+    sink = SMTPSink(args.smtp_latency / 1000, args.throttle_every)
+    client = DashClient(app.app)
+    results = []
+    try:
+        for rows in (int(count) for count in args.rows.split(",")):
+            print(f"Running {rows:,} rows...", file=sys.stderr)
+            results.extend(run_suite(rows, args, client, sink))
+            clear_caches(keep_dataset=False)
+    finally:
+        sink.shutdown()
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baseline = json.load(handle).get("results", {})
+    regressions = compare(results, baseline, args.tolerance)
+    report = format_report(results, regressions, args.tolerance)
+    report += (f"\n\nSMTP sink: {sink.received:,} accepted, {sink.throttled:,} throttled, "
+               f"{sink.connections:,} connections; Python {platform.python_version()}, pandas {pd.__version__}")
+    print(report)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(report + "\n")
+
+    if args.save_baseline:
+        baseline.update({f"{r['name']}@{r['rows']}": {"median_s": r["median_s"], "peak_mb": r["peak_mb"]}
+                         for r in results})
+        with open(args.baseline, "w") as handle:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(), "results": baseline},
+                      handle, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())